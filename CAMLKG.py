@@ -1,31 +1,35 @@
-import io
-import json
-import math
 import os
-import sqlite3
 import sys
-from pathlib import Path
-from sqlite3 import Error
-from urllib.parse import urljoin
+from collections import OrderedDict
 
-import folium
-import geopandas as gpd
-import matplotlib.image as mpimg
 import numpy as np
-import pandas as pd
 import pyqtgraph as pg
-import requests
-from bs4 import BeautifulSoup
-from folium import GeoJson
 from PyQt6 import QtCore, QtGui, QtWidgets, uic
 from PyQt6.QtCore import Qt, QUrl
 from PyQt6.QtGui import (QColor, QDesktopServices, QPixmap, QStandardItem,
                          QStandardItemModel)
-from PyQt6.QtWebEngineWidgets import QWebEngineView
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QMessageBox,
                              QStyledItemDelegate, QTableView, QVBoxLayout,
                              QWidget)
 
+from data_cube import DataCube
+from database import fetch_year, search_query, statistics_query, thread_connection
+from entity_graph import related_judgments
+from jid_index import JidIndex
+from kg_layout import ENTITY_COLORS, KnowledgeGraph, kg_layout
+from result_export import export_query
+from tasks import TaskScheduler, current_task
+from trace_panel import TracePanel
+from tracing import span, traced
+from triple_store import CAML_COLUMNS, triple_store
+
+MAP_ZOOM = 7
+MAP_TITLE = '臺灣縣市加密貨幣洗錢相關判決數量'
+PLAY_INTERVAL = 1500
+ALL = 'All'
+JID_COMPLETIONS = 200
+EXPORT_FILTERS = 'CSV (*.csv);;Excel (*.xlsx);;Parquet (*.parquet)'
+
 
 class LinkDelegate(QStyledItemDelegate):
     def createEditor(self, parent, option, index):
@@ -43,64 +47,217 @@ class LinkDelegate(QStyledItemDelegate):
         return super().editorEvent(event, model, option, index)
 
 class TableModel(QtCore.QAbstractTableModel):
- 
-    def __init__(self, data):
+    # 以 keyset 分頁向 SQLite 讀取資料，sql 必須包含整數排序鍵 _key 欄位 (不顯示)
+    # 只保留最近使用的幾頁 (column-major)，翻頁與捲動的成本只跟頁面大小有關
+    PAGE_SIZE = 10
+    CACHE_PAGES = 16
+
+    def __init__(self, conn, sql, params=(), page_size=PAGE_SIZE, index=None):
         super(TableModel, self).__init__()
-        self._data = data
- 
+        self.conn = conn
+        self.sql = sql
+        self.params = tuple(params)
+        self.page_size = page_size
+        if index is None:
+            index = TableModel.pageIndex(conn, sql, params, page_size)
+        self.columns, self.page_keys, self.total = index
+        self.select = ', '.join(f'"{name}"' for name in self.columns)
+        self.loaded = min(page_size, self.total)
+        self.pages = OrderedDict()
+
+    @staticmethod
+    def pageIndex(conn, sql, params=(), page_size=PAGE_SIZE):
+        # 查詢中唯一需要掃過全部結果的部分，可以在背景執行緒先算好再建立 model
+        params = tuple(params)
+        with span('sql.page_index'):
+            cur = conn.execute(f"SELECT * FROM ({sql}) LIMIT 0", params)
+            columns = [d[0] for d in cur.description if d[0] != '_key']
+            # 每頁第一筆的 key，可直接跳到任一頁而不需要 OFFSET
+            page_keys = [row[0] for row in conn.execute(
+                f"""SELECT _key FROM (
+                        SELECT _key, ROW_NUMBER() OVER (ORDER BY _key) - 1 AS n FROM ({sql})
+                    ) WHERE n % ? = 0 ORDER BY _key""", params + (page_size,))]
+            total = conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+        return columns, page_keys, total
+
+    def page(self, page):
+        columns = self.pages.get(page)
+        if columns is not None:
+            self.pages.move_to_end(page)
+            return columns
+        columns = self.readPage(page)
+        self.pages[page] = columns
+        if len(self.pages) > self.CACHE_PAGES:
+            self.pages.popitem(last=False)
+        return columns
+
+    def readPage(self, page):
+        with span('sql.page', page=page):
+            rows = self.conn.execute(
+                f"SELECT {self.select} FROM ({self.sql}) WHERE _key >= ? ORDER BY _key LIMIT ?",
+                self.params + (self.page_keys[page], self.page_size)).fetchall()
+        return list(zip(*rows)) if rows else [()] * len(self.columns)
+
+    def value(self, row, column):
+        if isinstance(column, str):
+            column = self.columns.index(column)
+        return self.page(row // self.page_size)[column][row % self.page_size]
+
+    def pageCount(self):
+        return len(self.page_keys)
+
+    def loadPage(self, page):
+        # 確保該頁已加入 model，回傳該頁第一列的 row
+        end = min((page + 1) * self.page_size, self.total)
+        if end > self.loaded:
+            self.beginInsertRows(QtCore.QModelIndex(), self.loaded, end - 1)
+            self.loaded = end
+            self.endInsertRows()
+        return page * self.page_size
+
+    def canFetchMore(self, index):
+        return not index.isValid() and self.loaded < self.total
+
+    def fetchMore(self, index):
+        if index.isValid():
+            return
+        self.loadPage(self.loaded // self.page_size)
+
     def data(self, index, role):
         if role == Qt.ItemDataRole.DisplayRole:
-            value = self._data.iloc[index.row(), index.column()] #pandas's iloc method
-            return str(value)
+            return str(self.value(index.row(), index.column()))
         if role == Qt.ItemDataRole.TextAlignmentRole:          
             return Qt.AlignmentFlag.AlignVCenter + Qt.AlignmentFlag.AlignHCenter
         if role == Qt.ItemDataRole.BackgroundRole and (index.row()%2 == 0):
             return QtGui.QColor('#F7E9F3')
  
     def rowCount(self, index):
-        return self._data.shape[0]
+        if index.isValid():
+            return 0
+        return self.loaded
  
     def columnCount(self, index):
-        return self._data.shape[1]
+        if index.isValid():
+            return 0
+        return len(self.columns)
  
     def headerData(self, section, orientation, role):
         if role == Qt.ItemDataRole.DisplayRole:
-            if orientation == Qt.Orientation.Horizontal and section < self._data.shape[1]:
-                return str(self._data.columns[section])
-            elif orientation == Qt.Orientation.Vertical and section < self._data.shape[0]:
-                return str(self._data.index[section])
+            if orientation == Qt.Orientation.Horizontal and section < len(self.columns):
+                return str(self.columns[section])
+            elif orientation == Qt.Orientation.Vertical and section < self.loaded:
+                return str(section + 1)
             else:
                 return None
-            
+
+class StoreTableModel(TableModel):
+    # 單一判決的結果直接取自 TripleStore 的連續區段 (TripleRows)，翻頁只是切片，不查詢 SQLite；
+    # sql / params 仍保留給匯出使用
+    def __init__(self, conn, sql, params, rows, page_size=TableModel.PAGE_SIZE):
+        index = (list(CAML_COLUMNS), rows.keys()[::page_size].tolist(), len(rows))
+        super(StoreTableModel, self).__init__(conn, sql, params, page_size, index=index)
+        self.rows = rows
+
+    def readPage(self, page):
+        # 與 SQLite 的頁面相同放進 LRU，每個儲存格只需取值，不必每次重新切片與解碼
+        start = page * self.page_size
+        return self.rows.columns(start, start + self.page_size)
+
+class JidModel(QtCore.QAbstractListModel):
+    # JidIndex 篩選結果的清單，與 TableModel 相同只在捲動到時才逐批加入，十萬筆也不會一次建立
+    # QCompleter 會一直 fetchMore 到沒有資料為止，給它的 model 以 limit 限制候選筆數
+    BATCH = 100
+
+    def __init__(self, parent=None, limit=None):
+        super(JidModel, self).__init__(parent)
+        self.jid_index = None
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.loaded = 0
+        self.limit = limit
+
+    def setJidIndex(self, index, text=''):
+        self.jid_index = index
+        self.setFilter(text)
+
+    def setFilter(self, text):
+        self.beginResetModel()
+        self.rows = self.jid_index.search(text) if self.jid_index is not None else np.zeros(0, dtype=np.int64)
+        self.rows = self.rows[:self.limit]
+        self.loaded = min(self.BATCH, len(self.rows))
+        self.endResetModel()
+
+    def canFetchMore(self, index):
+        return not index.isValid() and self.loaded < len(self.rows)
+
+    def fetchMore(self, index):
+        if index.isValid():
+            return
+        end = min(self.loaded + self.BATCH, len(self.rows))
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, end - 1)
+        self.loaded = end
+        self.endInsertRows()
+
+    def rowCount(self, index=QtCore.QModelIndex()):
+        if index.isValid():
+            return 0
+        return self.loaded
+
+    def data(self, index, role):
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self.jid_index.jids[self.rows[index.row()]]
+
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
         uic.loadUi('./CAMLKG.ui', self)
         self.show()
         self.tabWidget.setCurrentIndex(0)
-        # create a database connect
-        database = './CAMLKG.db'
-        self.conn = create_connection(database)
+        # 主執行緒共用同一個連線 (背景工作則各自使用所屬執行緒的連線)
+        self.conn = thread_connection()
         self.setWindowTitle('Judgement Visualize System')
-        self.SecondWindow = SecondWindow(self)
-        self.NewsWindow = NewsWindow(self)
-        items = fetch_jid(self.conn)
-        jid_items = set()
-        for item in items:
-            if item[0] is not None:
-                jid_items.add(str(item[0]))
-        self.JID_combo.addItems(list(jid_items)) # set 物件需要轉換成 list 物件才能被添加到 self.JID_combo
-        self.JID_combo.setCurrentIndex(-1)
+        self.map_view = None
+        self.tasks = TaskScheduler(self)
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setMaximumWidth(160)
+        self.progress_bar.hide()
+        self.statusbar.addPermanentWidget(self.progress_bar)
+        self.tasks.busyChanged.connect(self.showBusy)
+        self.tasks.progress.connect(self.showProgress)
+        # 知識圖譜與新聞視窗在第一次開啟時才建立，之後重複使用
+        self.SecondWindow = None
+        self.NewsWindow = None
+        # 判決字號：下拉清單與輸入時的候選都由背景建立的 JidIndex 提供，不把全部字號放進 combo
+        self.jid_index = None
+        self.JID_combo.setEditable(True)
+        self.JID_combo.setInsertPolicy(QtWidgets.QComboBox.InsertPolicy.NoInsert)
+        self.JID_combo.setModel(JidModel(self.JID_combo))
+        self.JID_combo.lineEdit().setPlaceholderText('Court, year, category or number…')
+        self.JID_combo.setEnabled(False)
+        self.jid_model = JidModel(self, limit=JID_COMPLETIONS)
+        self.jid_completer = QtWidgets.QCompleter(self.jid_model, self)
+        self.jid_completer.setCompletionMode(QtWidgets.QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.jid_completer.setMaxVisibleItems(15)
+        self.JID_combo.setCompleter(self.jid_completer)
+        self.tasks.submit('jids', load_jid_index, on_result=self.setJidIndex, on_error=self.showTaskError)
 
         
-        # items = fetch_year(self.conn)
-        # year_items = set()
-        # for item in items:
-        #     if item[0] is not None:
-        #         year_items.add(str(item[0]))
-        # self.year_combo.addItems(list(year_items))
+        items = fetch_year(self.conn)
+        self.year_combo.clear()
+        self.year_combo.addItems([str(item[0]) for item in items])
         self.year_combo.setToolTip("Tip: You must select one Year to search.")
         self.year_combo.setCurrentIndex(-1)
+        self.cube = None
+        self.play_timer = QtCore.QTimer(self)
+        self.play_timer.setInterval(PLAY_INTERVAL)
+        self.play_timer.timeout.connect(self.nextYear)
+        self.trend_plot.setBackground('transparent')
+        self.trend_plot.showGrid(y=True, alpha=0.3)
+        self.trend_plot.addLegend(offset=(10, 10))
+        self.tasks.submit('cube', load_cube, on_result=self.setCube, on_error=self.showTaskError)
+        self.trace_panel = None
+        trace_action = self.menubar.addMenu('Tools').addAction('Tracing…')
+        trace_action.setShortcut('Ctrl+Shift+T')
+        trace_action.triggered.connect(self.openTracePanel)
 
         style_sheet = '''
             QTextBrowser {
@@ -123,11 +280,20 @@ class MainWindow(QtWidgets.QMainWindow):
         self.exit_btn_2.clicked.connect(self.showExitDialog)
         self.comboBox_page.activated.connect(self.showTable) # activated 是當選單有被點擊時才觸發
         self.JID_combo.activated.connect(self.searchByJID)
+        self.JID_combo.lineEdit().returnPressed.connect(self.submitJid)
+        self.JID_combo.lineEdit().textEdited.connect(self.filterJids)
+        self.jid_completer.activated.connect(self.selectJid)
+        self.keyword_btn.clicked.connect(self.searchByKeyword)
+        self.keyword_edit.returnPressed.connect(self.searchByKeyword)
         self.tableView.doubleClicked.connect(self.Visualize)
         # self.plot_widget.setBackground('transparent')
         self.year_combo.activated.connect(self.getStatistics)
-        self.year_combo.activated.connect(self.show_map)
-        
+        self.region_combo.activated.connect(self.updateTrend)
+        self.category_combo.activated.connect(self.getStatistics)
+        self.play_btn.clicked.connect(self.togglePlay)
+        self.export_btn.clicked.connect(self.exportResults)
+        self.stats_export_btn.clicked.connect(self.exportStatistics)
+
         self.pushButton_first.clicked.connect(self.firstPage)
         self.pushButton_last.clicked.connect(self.lastPage)
         self.pushButton_previous.clicked.connect(self.previousPage)
@@ -135,194 +301,264 @@ class MainWindow(QtWidgets.QMainWindow):
         self.GoSearch_btn.clicked.connect(self.goSearch)
         self.news_btn.clicked.connect(self.open_news_window)
 
+    @traced('news.open')
     def open_news_window(self):
-        # self.NewsWindow = SecondWindow(self)
-        self.NewsWindow.news()
+        if self.NewsWindow is None:
+            self.NewsWindow = NewsWindow(self)
         self.NewsWindow.show()
+        self.NewsWindow.raise_()
+        self.tasks.submit('news', load_news,
+                          on_result=self.NewsWindow.news, on_error=self.showTaskError)
+
+    def openTracePanel(self):
+        # 延遲統計與 Chrome trace 匯出；追蹤預設關閉，可在面板中隨時開關 (或以 CAMLKG_TRACE=1 啟動)
+        if self.trace_panel is None:
+            self.trace_panel = TracePanel(self)
+        self.trace_panel.show()
+        self.trace_panel.raise_()
+
+    def showBusy(self, busy):
+        self.progress_bar.setRange(0, 0) # 未回報進度前顯示忙碌動畫
+        self.progress_bar.setVisible(busy)
+        if busy:
+            self.statusbar.showMessage('Loading...')
+        else:
+            self.statusbar.clearMessage()
+
+    def showProgress(self, key, percent):
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(percent)
 
+    def showTaskError(self, error):
+        QMessageBox.warning(self, "Warning", str(error))
+
+    @traced('visualize.open')
     def open_new_window(self):
-        if self.JID_combo.currentIndex() == -1:
+        jid = self.selectedJid()
+        if jid is None:
             QMessageBox.warning(self, "Warning", "Please select a JID!")
         else:
+            self.showKnowledgeGraph(jid)
+
+    def showKnowledgeGraph(self, jid):
+        if self.SecondWindow is None:
             self.SecondWindow = SecondWindow(self)
-            self.SecondWindow.update_KG_view()
-            self.SecondWindow.urlBrowser()
-            self.SecondWindow.show()
-        
+        self.SecondWindow.update_KG_view(jid)
+        self.SecondWindow.show()
+        self.SecondWindow.raise_()
+
     def showExitDialog(self):
         choice = QMessageBox.question(self, 'Exit Dialog', 'Are you sure to exit?')
         if choice == QMessageBox.StandardButton.Yes:
             self.conn.close() # close database
             self.close() # close app
 
+    @traced('ui.go_search')
     def goSearch(self):
         self.tabWidget.setCurrentIndex(1)
 
+    def setJidIndex(self, index):
+        self.jid_index = index
+        self.JID_combo.model().setJidIndex(index)
+        self.JID_combo.setCurrentIndex(-1)
+        self.jid_model.setJidIndex(index, self.JID_combo.currentText())
+        self.JID_combo.setEnabled(True)
+
+    @traced('search.filter_jid')
+    def filterJids(self, text):
+        # 以空白分隔法院、年度、字別、號數，例如「臺中 110 金訴 88」；每按一鍵重新篩選候選清單
+        if self.jid_index is None:
+            return
+        self.jid_model.setFilter(text)
+        if self.jid_model.rowCount():
+            self.jid_completer.complete()
+        else:
+            self.jid_completer.popup().hide()
+
+    def selectJid(self, jid):
+        self.JID_combo.setEditText(jid)
+        self.searchByJID()
+
+    def selectedJid(self):
+        jid = self.JID_combo.currentText().strip()
+        if self.jid_index is None or jid not in self.jid_index:
+            return None
+        return jid
+
+    def submitJid(self):
+        # 可編輯的 combo 只在輸入的字號位於已載入的列時才會送出 activated，
+        # 其餘完整的字號 (例如尚未捲動載入的) 以 jid_index 判斷後查詢
+        if self.JID_combo.findText(self.JID_combo.currentText()) >= 0:
+            return
+        if self.selectedJid() is not None:
+            self.searchByJID()
+
+    @traced('search.jid')
     def searchByJID(self):
-        jid_str = str(self.JID_combo.currentText())
-        sql = f"SELECT * FROM caml A WHERE A.JID='{jid_str}'"
-        with self.conn:
-            self.rows = SQLExecute(self, sql)
-            if len(self.rows) > 0: 
-                ToTableView(self, self.rows)
-
+        jid_str = self.JID_combo.currentText().strip()
+        if not jid_str:
+            return
+        sql = "SELECT * FROM caml_rows A WHERE A.JID = ?"
+        params = (jid_str,)
+        self.tasks.submit('search', load_jid_rows, jid_str,
+                          on_result=lambda rows: ToTableView(self, sql, params, rows=rows),
+                          on_error=self.showTaskError)
+
+    @traced('search.keyword')
+    def searchByKeyword(self):
+        text = self.keyword_edit.text().strip()
+        if not text:
+            QMessageBox.warning(self, "Warning", "Please enter a keyword!")
+            return
+        sql, params = search_query(text)
+        self.tasks.submit('search', table_index, sql, params,
+                          on_result=lambda index: ToTableView(self, sql, params, index),
+                          on_error=self.showTaskError)
+
+    @traced('page.select')
     def showTable(self):
         page = int(self.comboBox_page.currentText())
-        start_idx = (page - 1) * 10
-        end_idx = start_idx + 10
-        data = self.df.iloc[start_idx:end_idx, :]
-        self.model = TableModel(data)
-        self.tableView.setModel(self.model)
+        self.showPage(page)
+
+    def showPage(self, page):
+        row = self.model.loadPage(page - 1)
+        self.tableView.scrollTo(self.model.index(row, 0), QtWidgets.QAbstractItemView.ScrollHint.PositionAtTop)
+        self.comboBox_page.setCurrentText(str(page))
 
+    @traced('visualize.row')
     def Visualize(self, mi):
         # Fetch data from the SQLite database
-        col_list = list(self.df.columns)
-        jid = self.df.iloc[mi.row(), col_list.index('JID')]
-        self.cur = self.conn.cursor()
-        self.cur.execute(f"SELECT * FROM caml WHERE JID = ?", (jid,))
+        jid = self.model.value(mi.row(), 'JID')
         # Update the SecondWindow's KG view
-        self.SecondWindow = SecondWindow(self)
-        self.SecondWindow.update_KG_view()
-        self.SecondWindow.show()
-
+        self.showKnowledgeGraph(jid)
+
+    def setCube(self, cube):
+        self.cube = cube
+        for combo, values in ((self.region_combo, cube.regions), (self.category_combo, cube.categories)):
+            current = combo.currentText()
+            combo.clear()
+            combo.addItems([ALL] + values)
+            combo.setCurrentText(current or ALL)
+        self.getStatistics()
+
+    def exportPath(self, name):
+        path, selected = QtWidgets.QFileDialog.getSaveFileName(self, 'Export', name, EXPORT_FILTERS)
+        if path and not os.path.splitext(path)[1]:
+            path += selected.split('*')[-1].rstrip(')')
+        return path
+
+    @traced('export.results')
+    def exportResults(self):
+        # 匯出目前搜尋的全部結果 (不只目前的頁面)，在背景由 SQLite 分批讀出後寫檔
+        model = self.tableView.model()
+        if not isinstance(model, TableModel):
+            QMessageBox.warning(self, "Warning", "No results to export!")
+            return
+        path = self.exportPath('results.csv')
+        if path:
+            self.submitExport(path, f"SELECT * FROM ({model.sql}) ORDER BY _key", model.params, model.total)
+
+    @traced('export.statistics')
+    def exportStatistics(self):
+        # 依目前選擇的 Region / Category 匯出逐年、逐法院、逐類別的判決數
+        sql, params = statistics_query(self.selection(self.region_combo), self.selection(self.category_combo))
+        path = self.exportPath('statistics.csv')
+        if path:
+            self.submitExport(path, sql, params, None)
+
+    def submitExport(self, path, sql, params, total):
+        self.tasks.submit('export:' + path, export_results, sql, params, path, total,
+                          on_result=lambda count: self.statusbar.showMessage(f'{count} rows exported to {path}', 10000),
+                          on_error=self.showTaskError)
+
+    def selection(self, combo):
+        text = combo.currentText()
+        return None if text in ('', ALL) else text
+
+    @traced('statistics.select')
     def getStatistics(self):
+        # 地圖與趨勢圖都由記憶體中的 data cube 計算，切換年份或類別不再查詢資料庫
+        if self.cube is None:
+            return
         year = self.year_combo.currentText()
-        if year == '107':
-            sql = "SELECT * FROM '107'"
-        elif year == '108':
-            sql = "SELECT * FROM '108'"
-        elif year == '109':
-            sql = "SELECT * FROM '109'"
-        elif year == '110':
-            sql = "SELECT * FROM '110'"
-
-        with self.conn:
-            self.rows = SQLExecute(self, sql)
-        self.df = pd.DataFrame(self.rows, columns=['City/County', 'Count', 'CountySN'])
-
-        Dataset = self.df
-        json_file_path = r'./geo_taiwan_short.json'
-        # 讀入台灣行政區地理資料並取行政區名稱與界線經緯度
-        geojson = gpd.read_file(json_file_path, encoding='utf-8')
-        geojson=geojson[['name','geometry']]
-        # 整合人口數資料與行政區地理資料為單一 pandas 變數
-        self.df_final = geojson.merge(Dataset, left_on="name", right_on="City/County", how="outer") 
-        self.df_final = self.df_final[~self.df_final['geometry'].isna()]
-        with open(json_file_path, 'r', encoding='utf-8') as j:
-            self.geo_taiwan = json.loads(j.read())
-
-        # Bar Chart
-        # color_map = {'新北市': 'b','台北市': 'g','桃園市': 'r','台中市': 'c','台南市': 'm','高雄市': 'y','宜蘭縣': 'k','新竹縣': 'b','苗栗縣': 'g',
-        #             '彰化縣': 'r','南投縣': 'c','雲林縣': 'm','嘉義縣': 'y','屏東縣': 'k','台東縣': 'b','花蓮縣': 'g','澎湖縣': 'r','基隆市': 'c','新竹市': 'm',
-        #             '嘉義市': 'y','金門縣': 'k','連江縣': 'b'}
-
-        # x = np.arange(len(self.df['City/County']))
-        # y = np.array(self.df['Count'])
-        # colors = [color_map.get(city, 'gray') for city in self.df['City/County']]
-
-        # 建立BarGraphItem並將其添加到PlotWidget中
-        # bar_graph = pg.BarGraphItem(x=x, height=y, width=0.6, brushes=colors)
-        # self.plot_widget = pg.PlotWidget()
-        # self.plot_widget.setFixedSize(800, 600)
-        # self.plot_widget.addItem(bar_graph)
-
-        # 設定圖形標題和軸標籤
-        # self.plot_widget.setTitle('Count of Judgements by City/County')
-        # self.plot_widget.setLabel('left', 'Count')
-        # self.plot_widget.setLabel('bottom', 'City/County')
-
-        # 顯示圖形
-        # self.plot_widget.show()
-        # styles = {'color':'black', 'font-size':'11px'}
-        # self.plot_widget.setLabel('left', 'Count', **styles)
-        # self.plot_widget.setLabel('bottom', 'City/Country', **styles)
-
-    def show_map(self):
-        # 刪除上一次選擇的地圖
-        while self.verticalLayout_2.count():
-            item = self.verticalLayout_2.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.deleteLater()
-
-        current_dir = Path(__file__).resolve().parent
-        m = folium.Map(location=[23.73, 120.96], zoom_start=7)
-        folium.Choropleth(
-                geo_data = self.geo_taiwan,#Assign geo_data to your geojson file
-                name = "choropleth",
-                data = self.df_final,#Assign dataset of interest
-                columns = ["City/County","Count"],#Assign columns in the dataset for plotting
-                key_on = 'feature.properties.name',#Assign the key that geojson uses to connect with dataset
-                fill_color = 'YlOrRd',
-                fill_opacity = 0.7,
-                line_opacity = 0.5,
-                reset=True,
-                legend_name = '臺灣縣市加密貨幣洗錢相關判決數量').add_to(m)
-         
-        folium.GeoJson(
-                data=self.df_final, #Dataset merged from pandas and geojson
-                name='Count',
-                smooth_factor=2,
-                style_function=lambda x: {'color':'black','fillColor':'transparent','weight':0.1},
-                tooltip=folium.GeoJsonTooltip(
-                       fields=['City/County',
-                                'Count'
-                               ],
-                       aliases=['行政區',
-                                '判決數'
-                                ], 
-                        localize=True,
-                        sticky=False,
-                        labels=True,
-                        style="""
-                            background-color: #F0EFEF;
-                            border: 2px solid black;
-                            border-radius: 3px;
-                            box-shadow: 3px;
-                        """,
-                        max_width=800),
-                highlight_function=lambda x: {'weight':3,'fillColor':'grey'},
-                        ).add_to(m) 
- 
-        data = io.BytesIO()
-        m.save(data, close_file = False)
-        filename = os.fspath(current_dir / "map.html")
-        m.save(filename)
-        webView = QWebEngineView()  # a QWidget
-        webView.setHtml(data.getvalue().decode()) # html size < 2M
- 
-        self.verticalLayout_2.addWidget(webView, 0) # at position 0
-
+        if year:
+            self.show_map(self.cube.county_rows(year, self.selection(self.category_combo)),
+                          f'{MAP_TITLE} ({year})')
+        self.updateTrend()
+
+    @traced('statistics.trend')
+    def updateTrend(self):
+        if self.cube is None:
+            return
+        region = self.selection(self.region_combo)
+        category = self.selection(self.category_combo)
+        series = self.cube.series(region, category)
+        delta, percent = self.cube.yoy(region, category)
+        x = np.array([int(year) for year in self.cube.years])
+
+        self.trend_plot.clear()
+        self.trend_plot.addItem(pg.BarGraphItem(x=x, height=delta, width=0.4, brush='#FDB863', name='YoY change'))
+        self.trend_plot.plot(x, series, pen=pg.mkPen('#B2182B', width=2), symbol='o', symbolSize=7,
+                             symbolBrush='#B2182B', name='Judgments')
+        self.trend_plot.getAxis('bottom').setTicks([[(value, str(value)) for value in x]])
+        year = self.year_combo.currentText()
+        if year in self.cube.years:
+            self.trend_plot.addItem(pg.InfiniteLine(int(year), pen=pg.mkPen('#757575', style=Qt.PenStyle.DashLine)))
+        title = f'{region or ALL} / {category or ALL}'
+        if len(series) > 1 and not np.isnan(percent[-1]):
+            title += f'：{self.cube.years[-1]} 年 {int(delta[-1]):+d} 件 ({percent[-1]:+.0f}%)'
+        self.trend_plot.setTitle(title)
+
+    @traced('statistics.play')
+    def togglePlay(self):
+        # 依序播放各年份的地圖，只更新各縣市的判決數
+        if self.play_timer.isActive():
+            self.play_timer.stop()
+            self.play_btn.setText('Play')
+        elif self.year_combo.count():
+            self.play_btn.setText('Stop')
+            self.nextYear()
+            self.play_timer.start()
+
+    @traced('statistics.next_year')
+    def nextYear(self):
+        self.year_combo.setCurrentIndex((self.year_combo.currentIndex() + 1) % self.year_combo.count())
+        self.getStatistics()
+
+    def show_map(self, rows, title=MAP_TITLE):
+        self.rows = rows
+        # 地圖只建立一次，之後切換年份只更新各縣市的判決數
+        if self.map_view is None:
+            from geometry import geometry_service
+            from map_view import ChoroplethView
+            with span('widget.map_view'):
+                self.map_view = ChoroplethView(geometry_service().geojson(zoom=MAP_ZOOM), zoom=MAP_ZOOM)
+                self.verticalLayout_2.addWidget(self.map_view, 0) # at position 0
+        self.map_view.setCounts(self.rows, title)
+
+    @traced('page.first')
     def firstPage(self):
             try:
                 page = int(1)
                 if self.comboBox_page.currentText() == str(page):
                     QMessageBox.warning(self, "Warning", "This is already the first page!")
                 else:
-                    self.comboBox_page.setCurrentText(str(page))
-                    start_idx = (page - 1) * 10
-                    end_idx = start_idx + 10
-                    data = self.df.iloc[start_idx:end_idx, :]
-                    self.model = TableModel(data)
-                    self.tableView.setModel(self.model)
+                    self.showPage(page)
             except:
                 QMessageBox.warning(self, "Warning", "No result!")
 
+    @traced('page.last')
     def lastPage(self):
         try:
             page = int(self.comboBox_page.itemText(self.comboBox_page.count() - 1))
             if self.comboBox_page.currentText() == str(page):
                     QMessageBox.warning(self, "Warning", "This is already the last page!")
             else:
-                self.comboBox_page.setCurrentText(str(page))
-                start_idx = (page - 1) * 10
-                end_idx = start_idx + 10
-                data = self.df.iloc[start_idx:end_idx, :]
-                self.model = TableModel(data)
-                self.tableView.setModel(self.model)
+                self.showPage(page)
         except:
             QMessageBox.warning(self, "Warning", "No result!")
         
+    @traced('page.previous')
     def previousPage(self):
         try:
             page = int(self.comboBox_page.currentText())
@@ -330,15 +566,11 @@ class MainWindow(QtWidgets.QMainWindow):
             if page == first_page:
                 QMessageBox.warning(self, "Warning", "This is already the first page!")
             else:
-                start_idx = (page - 2) * 10
-                end_idx = start_idx + 10
-                data = self.df.iloc[start_idx:end_idx, :]
-                self.model = TableModel(data)
-                self.tableView.setModel(self.model)
-                page = self.comboBox_page.setCurrentText(str(int(self.comboBox_page.currentText())-1))
+                self.showPage(page - 1)
         except:
             QMessageBox.warning(self, "Warning", "No result!")
 
+    @traced('page.next')
     def nextPage(self):
         try:
             page = int(self.comboBox_page.currentText())
@@ -346,12 +578,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if page == last_page:
                 QMessageBox.warning(self, "Warning", "This is already the last page!") 
             else:
-                start_idx = (page) * 10
-                end_idx = start_idx + 10
-                data = self.df.iloc[start_idx:end_idx, :]
-                self.model = TableModel(data)
-                self.tableView.setModel(self.model)
-                page = self.comboBox_page.setCurrentText(str(int(self.comboBox_page.currentText())+1))
+                self.showPage(page + 1)
         except: 
             QMessageBox.warning(self, "Warning", "No result!")
 
@@ -360,55 +587,131 @@ class SecondWindow(QtWidgets.QMainWindow):
         super(SecondWindow, self).__init__(parent)
         uic.loadUi('./KG_visual.ui', self)
         self.tabWidget.setCurrentIndex(0)
-        database = './CAMLKG.db'
-        # create a database connect
-        self.conn = create_connection(database)
         self.setWindowTitle('Judgement Visualize System')
         self.parent = parent
-        self.urlBrowser()
+        self.legend = None
+        self.tiles = None
+        self.jid = None
+        # 司法院網站只在切換到該分頁時才載入
+        self.web_view = None
+        self.tabWidget.currentChanged.connect(self.showTab)
         self.back_btn.clicked.connect(self.backToMainWindow)
         self.back_btn_2.clicked.connect(self.backToMainWindow)
-
-    def update_KG_view(self):
-        jid = str(self.parent.JID_combo.currentText())
+        self.related_table.setColumnCount(4)
+        self.related_table.setHorizontalHeaderLabels(['JID', 'Hops', 'Score', 'Shared Entities'])
+        self.related_table.verticalHeader().hide()
+        self.related_table.cellDoubleClicked.connect(self.openRelated)
+        self.hops_spin.valueChanged.connect(self.updateRelated)
+        self.similar_table.setColumnCount(3)
+        self.similar_table.setHorizontalHeaderLabels(['JID', 'Similarity', 'Shared Features'])
+        self.similar_table.verticalHeader().hide()
+        self.similar_table.cellDoubleClicked.connect(self.openSimilar)
+
+    @traced('visualize.update_kg_view')
+    def update_KG_view(self, jid=None):
+        if jid is None:
+            jid = str(self.parent.JID_combo.currentText())
+        self.jid = jid
         self.KG_label.setText(f'Knowledge Graph of "{jid}"')
-        # img_path = u"./images/" + jid + ".png"
-        # pixmap = QPixmap(img_path)
-        # image = pixmap.toImage()
-        # scaled_image = image.scaled(self.KG_view.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        # scaled_pixmap = QPixmap.fromImage(scaled_image)
-        # self.KG_view.setPixmap(scaled_pixmap)
-        # self.KG_view.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.graphWidget.setBackground('transparent')
+        if self.tiles is not None:
+            self.tiles.close()
+            self.tiles = None
         self.graphWidget.clear()
-        img_dir = "./images/"
-        img_name = jid + ".png"
-        image = mpimg.imread(img_dir + img_name)
-        img_item = pg.ImageItem(image, axisOrder='row-major')
-         
-        self.graphWidget.addItem(img_item)
-        self.graphWidget.invertY(True)
+        if self.legend is not None:
+            # clear() 不會移除圖例裡的項目，否則換成只有 PNG 的判決時仍留著上一張圖的實體類型
+            self.legend.clear()
         self.graphWidget.getAxis('bottom').setTicks('')
         self.graphWidget.getAxis('left').setTicks('')
         self.graphWidget.setAspectLocked(lock=True, ratio=1)
 
+        self.parent.tasks.submit('kg', load_knowledge_graph, jid,
+                                 on_result=self.showGraph, on_error=self.parent.showTaskError)
+        self.updateRelated()
+        self.parent.tasks.submit('similar', load_similar, jid,
+                                 on_result=self.showSimilar, on_error=self.parent.showTaskError)
+
+    @traced('visualize.related')
+    def updateRelated(self):
+        # 跨判決的實體索引第一次使用時在背景建立 (或由磁碟讀入)
+        if self.jid is None:
+            return
+        self.parent.tasks.submit('related', load_related, self.jid, self.hops_spin.value(),
+                                 on_result=self.showRelated, on_error=self.parent.showTaskError)
+
+    def showRelated(self, rows):
+        fill_table(self.related_table, rows)
+
+    @traced('visualize.open_related')
+    def openRelated(self, row, column):
+        self.update_KG_view(self.related_table.item(row, 0).text())
+
+    def showSimilar(self, rows):
+        fill_table(self.similar_table, rows)
+
+    @traced('visualize.open_similar')
+    def openSimilar(self, row, column):
+        self.update_KG_view(self.similar_table.item(row, 0).text())
+
+    @traced('widget.show_graph')
+    def showGraph(self, graph):
+        from kg_tiles import Pyramid, TiledImage
+        if graph is None:
+            QMessageBox.warning(self, "Warning", "No knowledge graph for this JID!")
+        elif isinstance(graph, KnowledgeGraph):
+            self.draw_graph(graph)
+        elif isinstance(graph, Pyramid):
+            self.graphWidget.invertY(True)
+            self.tiles = TiledImage(self.graphWidget, graph)
+
+    @traced('widget.draw_graph')
+    def draw_graph(self, graph):
+        self.graphWidget.invertY(False)
+        brushes = [pg.mkBrush(ENTITY_COLORS.get(t, '#7F7F7F')) for t in graph.types]
+        graph_item = pg.GraphItem()
+        graph_item.setData(pos=graph.pos, adj=graph.edges, size=18, pxMode=True,
+                           symbol='o', symbolBrush=brushes, symbolPen=pg.mkPen('w', width=1),
+                           pen=pg.mkPen('#9E9E9E', width=1))
+        self.graphWidget.addItem(graph_item)
+
+        for (head, tail), relation in zip(graph.edges, graph.relations):
+            x, y = (graph.pos[head] + graph.pos[tail]) / 2
+            label = pg.TextItem(relation, color='#757575', anchor=(0.5, 0.5))
+            label.setPos(x, y)
+            self.graphWidget.addItem(label)
+        for name, (x, y) in zip(graph.nodes, graph.pos):
+            label = pg.TextItem(name, color='k', anchor=(0.5, -0.4))
+            label.setPos(x, y)
+            self.graphWidget.addItem(label)
+
+        # 圖例：每種實體類型一個顏色
+        if self.legend is None:
+            self.legend = self.graphWidget.addLegend(offset=(10, 10))
+        self.legend.clear()
+        for entity_type in dict.fromkeys(graph.types):
+            sample = pg.ScatterPlotItem(symbol='o', size=10, pen=None,
+                                        brush=pg.mkBrush(ENTITY_COLORS.get(entity_type, '#7F7F7F')))
+            self.legend.addItem(sample, entity_type)
+
+    def showTab(self, index):
+        if self.tabWidget.widget(index) is self.tab_2:
+            self.urlBrowser()
+
+    @traced('widget.web_view')
     def urlBrowser(self):
+        if self.web_view is not None:
+            return
+        from PyQt6.QtWebEngineWidgets import QWebEngineView
         url = 'https://judgment.judicial.gov.tw/FJUD/default.aspx'
-        webView2 = QWebEngineView()
-        webView2.load(QUrl(url))
-         
-        # clear the current widget in the verticalLayout before adding one
-        if self.judicial_web.itemAt(0) : # if any existing widget
-            self.judicial_web.itemAt(0).widget().setParent(None)
-         
-        self.judicial_web.addWidget(webView2)
-        
+        self.web_view = QWebEngineView()
+        self.web_view.load(QUrl(url))
+        self.judicial_web.addWidget(self.web_view)
 
     def backToMainWindow(self):
-        self.conn.close() # close database
-        self.close() # close app
-        main = MainWindow()
-        main.show()
+        # 視窗只是隱藏，下次開啟時沿用 (包含已載入的網頁)
+        self.hide()
+        self.parent.show()
+        self.parent.raise_()
 
 class NewsWindow(QtWidgets.QMainWindow):
     def __init__(self, parent=MainWindow):
@@ -417,12 +720,7 @@ class NewsWindow(QtWidgets.QMainWindow):
         self.setWindowTitle('News of Courts')
         self.parent = parent
 
-    def news(self):
-        url = "https://www.judicial.gov.tw/tw/lp-1888-1.html"
-        response = requests.get(url)
-        html_content = response.text
-        soup = BeautifulSoup(html_content, "html.parser")
-        table = soup.find("table", class_="table_sprite")
+    def news(self, rows):
         table_view = self.findChild(QtWidgets.QTableView, 'news_table')
         model = table_view.model()
         if model is None:
@@ -432,19 +730,7 @@ class NewsWindow(QtWidgets.QMainWindow):
 
         header_labels = ["Title", "Post Date", "Unit/Organization"]
         model.setHorizontalHeaderLabels(header_labels)
-
-        table_rows = table.find_all("tr")
-        for row in table_rows[1:16]:
-            cells = row.find_all("td")
-            row_data = [cell.get_text(strip=True) for cell in cells]
-            item = [QStandardItem(data) for data in row_data]
-            del item[0]
-
-            href = cells[1].find("a").get("href")
-            abs_href = urljoin(url, href)
-            print(abs_href)
-            item[0].setData(abs_href, Qt.ItemDataRole.UserRole)
-            model.appendRow(item)
+        update_news_model(model, rows)
 
         # 設定tableView屬性
         table_view.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
@@ -469,75 +755,119 @@ class NewsWindow(QtWidgets.QMainWindow):
     #     self.news_page.addWidget(webView3)
         
 
-def create_connection(db_file):
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-    except Error as e:
-        print(e)
- 
-    return conn
-
-def SQLExecute(self, SQL):
-    self.cur = self.conn.cursor()
-    self.cur.execute(SQL)
-    rows = self.cur.fetchall()
-
-    if len(rows) == 0 and SQL != '': # nothing found
-        # raise a messageBox here
-        dlg = QMessageBox(self)
-        # dlg.setIcon(QMessageBox.Icon.Warning)
-        dlg.setWindowTitle("SQL Information: ")
-        dlg.setText("No data match the query!")
-        dlg.setStandardButtons(QMessageBox.StandardButton.Yes)
-        buttonY = dlg.button(QMessageBox.StandardButton.Yes)
-        buttonY.setText('OK')
-        dlg.setIcon(QMessageBox.Icon.Information)
-        button = dlg.exec()
-        # return
-    return rows
-
-def ToTableView(self, rows):
-    self.comboBox_page.clear()
-    names = [description[0] for description in self.cur.description] # extract column names
-    self.df = pd.DataFrame(rows)
-    self.model = TableModel(self.df)
-    self.tableView.setModel(self.model)
-    self.df.columns = names
-    self.df.index = range(1, len(rows)+1)
-    self.lineEdit_total.setText(str(len(rows)))
-    self.comboBox_page.addItems(list(map(str, range(1, math.ceil(len(rows)/10)+1))))
-
-    page = 0
-    start_idx = (page) * 10
-    end_idx = start_idx + 10
-    data = self.df.iloc[start_idx:end_idx, :]
-    self.model = TableModel(data)
-    self.tableView.setModel(self.model)
+def table_index(sql, params):
+    return TableModel.pageIndex(thread_connection(), sql, params)
+
+def export_results(sql, params, path, total):
+    return export_query(thread_connection(), sql, params, path, total, progress=current_task().setProgress)
+
+def load_jid_index():
+    return JidIndex.build(thread_connection())
+
+def load_cube():
+    from geometry import geometry_service
+    cube = DataCube.build(thread_connection())
+    geometry_service().geojson(zoom=MAP_ZOOM) # 第一次使用時在背景讀入縣市界線
+    return cube
+
+def load_jid_rows(jid):
+    return triple_store(thread_connection()).rows(jid)
+
+def load_knowledge_graph(jid):
+    rows = triple_store(thread_connection()).rows(jid).triples()
+    if rows:
+        return kg_layout(jid, rows)
+    # 沒有三元組資料的判決才使用預先繪製的圖檔，轉成 tile pyramid 後只讀入看得到的部分
+    from kg_tiles import load_pyramid
+    return load_pyramid(jid)
+
+def load_related(jid, hops):
+    return related_judgments(thread_connection(), jid, hops)
+
+def load_similar(jid):
+    # 相似度索引第一次使用時由磁碟讀入，資料庫有新判決時增量更新
+    from similarity import similar_judgments
+    return similar_judgments(thread_connection(), jid)
+
+def fill_table(table, rows):
+    table.setRowCount(len(rows))
+    for row, values in enumerate(rows):
+        for column, value in enumerate(values):
+            table.setItem(row, column, QtWidgets.QTableWidgetItem(str(value)))
+    table.resizeColumnsToContents()
+
+def load_news():
+    from court_news import news_client
+    return news_client().fetch(progress=current_task().setProgress)
+
+def update_news_model(model, rows):
+    # 以連結為 key 只套用差異：移除消失的列、更新內容有變的列、插入或移動新的列
+    hrefs = set(href for _, href in rows)
+    for row in reversed(range(model.rowCount())):
+        if model.item(row, 0).data(Qt.ItemDataRole.UserRole) not in hrefs:
+            model.removeRow(row)
+
+    for row, (row_data, href) in enumerate(rows):
+        current = model.item(row, 0) if row < model.rowCount() else None
+        if current is None or current.data(Qt.ItemDataRole.UserRole) != href:
+            for later in range(row + 1, model.rowCount()):
+                if model.item(later, 0).data(Qt.ItemDataRole.UserRole) == href:
+                    model.insertRow(row, model.takeRow(later))
+                    break
+            else:
+                item = [QStandardItem(data) for data in row_data]
+                item[0].setData(href, Qt.ItemDataRole.UserRole)
+                model.insertRow(row, item)
+                continue
+        for column, data in enumerate(row_data):
+            if model.item(row, column).text() != data:
+                model.item(row, column).setText(data)
+
+def NoDataMessage(self):
+    # raise a messageBox here
+    dlg = QMessageBox(self)
+    # dlg.setIcon(QMessageBox.Icon.Warning)
+    dlg.setWindowTitle("SQL Information: ")
+    dlg.setText("No data match the query!")
+    dlg.setStandardButtons(QMessageBox.StandardButton.Yes)
+    buttonY = dlg.button(QMessageBox.StandardButton.Yes)
+    buttonY.setText('OK')
+    dlg.setIcon(QMessageBox.Icon.Information)
+    button = dlg.exec()
+
+def ToTableView(self, sql, params=(), index=None, rows=None):
+    # rows 為 TripleStore 的一段時直接由記憶體顯示，否則以 keyset 分頁查詢 sql
+    with span('widget.table_view'):
+        if rows is not None:
+            model = StoreTableModel(self.conn, sql, params, rows)
+        else:
+            model = TableModel(self.conn, sql, params, index=index)
+        if model.total == 0:
+            NoDataMessage(self)
+            return
+        self.comboBox_page.clear()
+        self.model = model
+        self.tableView.setModel(self.model)
+        self.lineEdit_total.setText(str(model.total))
+        self.comboBox_page.addItems(list(map(str, range(1, model.pageCount()+1))))
+        self.comboBox_page.setCurrentIndex(0)
 
 
 def exit():
     app = QtWidgets.QApplication(sys.argv) #sys.argv
     sys.exit(app.exec())
 
-def fetch_jid(conn):
-    cur = conn.cursor()
-    sql = "select jid from caml"
-    cur.execute(sql)
-    rows = cur.fetchall()
-    return rows
-
-def fetch_year(conn):
-    cur = conn.cursor()
-    sql = "select year from caml"
-    cur.execute(sql)
-    rows = cur.fetchall()
-    return rows
-
 def main():
-    database = './CAMLKG.db' # 建立與數據庫的連接
-    conn = create_connection(database)
-    conn.close()
+    # python -m CAMLKG export ...：不開啟視窗，批次匯出統計、地圖與知識圖譜
+    if sys.argv[1:2] == ['export']:
+        from batch_export import main as export_main
+        sys.exit(export_main(sys.argv[2:]))
+    # python -m CAMLKG ingest FILE ...：將 JSONL / CSV 的三元組批次寫入資料庫
+    if sys.argv[1:2] == ['ingest']:
+        from ingest import main as ingest_main
+        sys.exit(ingest_main(sys.argv[2:]))
+    # 地圖與網頁元件在第一次使用時才載入 QtWebEngine，必須在建立 QApplication 前設定
+    QtCore.QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
     app = QtWidgets.QApplication(sys.argv)
     main = MainWindow()
     main.show()
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from database import DATABASE, county_statistics, create_connection, fetch_year
+from kg_layout import ENTITY_COLORS, KnowledgeGraph, kg_layout
+
+EXPORT_DIR = './export'
+EXPORT_VERSION = 1
+FORMATS = ('csv', 'html', 'png', 'graph')
+MAP_ZOOM = 7
+MAP_TITLE = '臺灣縣市加密貨幣洗錢相關判決數量'
+# matplotlib 逐字 fallback，找得到任一中文字型即可正常顯示
+FONT_FAMILY = ['Noto Sans CJK TC', 'Microsoft JhengHei', 'PingFang TC', 'Heiti TC', 'DejaVu Sans']
+
+
+def digest(*parts):
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['City/County', 'Count', 'CountySN'])
+        writer.writerows(rows)
+
+
+def write_map_html(path, rows):
+    from choropleth import choropleth_html
+    from geometry import geometry_service
+    html = choropleth_html(geometry_service().geojson(zoom=MAP_ZOOM), rows, MAP_TITLE, zoom=MAP_ZOOM)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(html)
+
+
+def new_figure(size):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def write_map_png(path, rows):
+    from geometry import geometry_service
+    frame = geometry_service().join(rows, zoom=MAP_ZOOM)
+    fig = new_figure((6, 8))
+    ax = fig.add_subplot()
+    frame.plot(ax=ax, column='Count', cmap='YlOrRd', legend=True, edgecolor='black', linewidth=0.3)
+    ax.set_title(MAP_TITLE, fontfamily=FONT_FAMILY)
+    ax.set_axis_off()
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+
+
+def write_graph_png(path, jid, rows):
+    from matplotlib.collections import LineCollection
+    graph = kg_layout(jid, rows)
+    fig = new_figure((10, 8))
+    ax = fig.add_subplot()
+    ax.add_collection(LineCollection(graph.pos[graph.edges], colors='#9E9E9E', linewidths=1, zorder=1))
+    ax.scatter(graph.pos[:, 0], graph.pos[:, 1], s=200, zorder=2, edgecolors='white',
+               c=[ENTITY_COLORS.get(t, '#7F7F7F') for t in graph.types])
+    for (head, tail), relation in zip(graph.edges, graph.relations):
+        x, y = (graph.pos[head] + graph.pos[tail]) / 2
+        ax.text(x, y, relation, color='#757575', fontsize=7, ha='center', va='center', fontfamily=FONT_FAMILY)
+    for name, (x, y) in zip(graph.nodes, graph.pos):
+        ax.text(x, y - 0.06, name, fontsize=8, ha='center', va='top', fontfamily=FONT_FAMILY)
+    ax.set_title(jid, fontfamily=FONT_FAMILY)
+    ax.set_aspect('equal')
+    ax.margins(0.1)
+    ax.set_axis_off()
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+
+
+WRITERS = {'csv': write_csv, 'html': write_map_html, 'png': write_map_png, 'graph': write_graph_png}
+
+
+def run_job(job):
+    kind, path, args = job
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp{os.path.splitext(path)[1]}'
+    WRITERS[kind](tmp_path, *args)
+    os.replace(tmp_path, path)
+    return path
+
+
+def iter_judgments(conn):
+    cur = conn.execute(
+        '''SELECT JID, "head entity type", "head entity", relation, "tail entity", "tail entity type"
+           FROM caml_rows ORDER BY JID, _key''')
+    for jid, rows in itertools.groupby(cur, key=lambda row: row[0]):
+        yield jid, [row[1:] for row in rows]
+
+
+def plan_jobs(conn, out_dir, years, formats, manifest, force=False):
+    # 依輸入資料計算 digest，與 manifest 相同且檔案仍在的輸出不再重做
+    jobs = []
+    skipped = 0
+
+    def add(kind, relpath, key, args):
+        nonlocal skipped
+        path = os.path.join(out_dir, relpath)
+        if not force and manifest.get(relpath) == key and os.path.exists(path):
+            skipped += 1
+        else:
+            jobs.append((relpath, key, (kind, path, args)))
+
+    if {'csv', 'html', 'png'} & set(formats):
+        from geometry import GEOJSON_PATH
+        geometry_stamp = os.stat(GEOJSON_PATH).st_mtime_ns
+        for year in years:
+            rows = county_statistics(conn, years=[year])
+            key = digest(EXPORT_VERSION, rows)
+            map_key = digest(EXPORT_VERSION, rows, geometry_stamp, MAP_ZOOM)
+            if 'csv' in formats:
+                add('csv', os.path.join('stats', f'{year}.csv'), key, (rows,))
+            if 'html' in formats:
+                add('html', os.path.join('maps', f'{year}.html'), map_key, (rows,))
+            if 'png' in formats:
+                add('png', os.path.join('maps', f'{year}.png'), map_key, (rows,))
+
+    if 'graph' in formats:
+        for jid, rows in iter_judgments(conn):
+            key = digest(EXPORT_VERSION, KnowledgeGraph(rows).digest())
+            add('graph', os.path.join('graphs', f'{jid}.png'), key, (jid, rows))
+    return jobs, skipped
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def export(db=DATABASE, out_dir=EXPORT_DIR, years=None, formats=FORMATS, workers=None, force=False):
+    conn = create_connection(db)
+    try:
+        if not years:
+            years = [row[0] for row in fetch_year(conn)]
+        manifest = load_manifest(out_dir)
+        jobs, skipped = plan_jobs(conn, out_dir, years, formats, manifest, force)
+    finally:
+        conn.close()
+
+    written = 0
+    failed = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(relpath, key, executor.submit(run_job, job)) for relpath, key, job in jobs]
+            try:
+                for relpath, key, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f'{relpath}: {e}', file=sys.stderr)
+                        continue
+                    manifest[relpath] = key
+                    written += 1
+            finally:
+                save_manifest(out_dir, manifest)
+    print(f'{written} written, {skipped} unchanged, {failed} failed -> {out_dir}')
+    return failed == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m CAMLKG export',
+                                     description='Export statistics, maps and knowledge graphs without the GUI.')
+    parser.add_argument('--db', default=DATABASE)
+    parser.add_argument('--out', default=EXPORT_DIR)
+    parser.add_argument('--years', nargs='+', help='default: every year in the database')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='rebuild outputs even if their inputs are unchanged')
+    args = parser.parse_args(argv)
+    ok = export(args.db, args.out, args.years, args.formats, args.workers, args.force)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
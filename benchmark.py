@@ -0,0 +1,441 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from database import DATABASE, create_connection
+
+BENCH_DIR = './bench'
+GENERATOR_VERSION = 1
+SIZES = ('10k', '100k', '1M', '10M')
+REPEAT = 5
+CHUNK = 100000
+# 工作目錄需要的介面與資料檔，以連結指回專案，快取 (layouts / cache / tiles) 則留在各自的工作目錄
+WORKDIR_FILES = ('CAMLKG.ui', 'KG_visual.ui', 'news.ui', 'geo_taiwan_short.json', 'images')
+CACHE_DIRS = ('layouts', 'cache', 'tiles')
+ENTITY_PREFIX = {'Person': '被告', 'Account': '帳戶', 'Money': '金額', 'Cryptocurrency': '虛擬貨幣',
+                 'Organization': '公司', 'Law': '法條'}
+# 每個三元組對應的實體池大小，約為實際資料的 實體數 / 三元組數
+ENTITY_RATIO = 0.6
+
+
+def parse_size(text):
+    units = {'k': 10 ** 3, 'm': 10 ** 6}
+    text = text.strip().lower()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# ---- 合成資料 ----
+
+def court_name(region):
+    if region.startswith(('臺灣高等法院', '福建')):
+        return region
+    return f'臺灣{region}地方法院'
+
+
+class Reference:
+    # 從實際資料庫取得各種分布：判決的 (region, year, category)、每個判決的三元組數、
+    # (head type, relation, tail type) 的組合，以及各類型最常見的實體名稱
+    def __init__(self, path=DATABASE):
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            rows = conn.execute('SELECT "head entity type", "head entity", relation, "tail entity", '
+                                '"tail entity type", JID, region, year, category FROM caml').fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            raise ValueError(f'{path} has no triples to take distributions from')
+        judgments = {}
+        names = {}
+        patterns = Counter()
+        per_judgment = Counter()
+        for head_type, head, relation, tail, tail_type, jid, region, year, category in rows:
+            judgments[jid] = (region, year, category)
+            per_judgment[jid] += 1
+            patterns[(head_type, relation, tail_type)] += 1
+            for name, kind in ((head, head_type), (tail, tail_type)):
+                names.setdefault(kind, Counter())[name] += 1
+        self.judgments = list(judgments.values())
+        self.triple_counts = np.array(list(per_judgment.values()))
+        self.patterns = list(patterns)
+        self.pattern_weights = np.array(list(patterns.values()), dtype=float) / sum(patterns.values())
+        self.names = {kind: [name for name, _ in counter.most_common()] for kind, counter in names.items()}
+
+
+def generate_corpus(path, triples, reference, seed=0, progress=print):
+    rng = np.random.default_rng(seed)
+    for stale in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    conn = create_connection(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.isolation_level = None
+
+    # 判決：逐一抽三元組數直到總數達到目標，(region, year, category) 依實際判決抽樣
+    counts = []
+    total = 0
+    while total < triples:
+        batch = rng.choice(reference.triple_counts, size=max(16, (triples - total) // 10))
+        counts.extend(batch.tolist())
+        total += int(batch.sum())
+    counts = np.array(counts)
+    end = np.searchsorted(np.cumsum(counts), triples) + 1
+    counts = counts[:end]
+    counts[-1] -= counts.sum() - triples
+    numbers = Counter()
+    judgment_rows = []
+    for i, pick in enumerate(rng.integers(len(reference.judgments), size=len(counts)), 1):
+        region, year, category = reference.judgments[pick]
+        numbers[region, year, category] += 1
+        jid = f'{court_name(region)} {year} 年度{category}字第 {numbers[region, year, category]} 號刑事判決'
+        judgment_rows.append((i, jid, region, year, category, str(numbers[region, year, category])))
+
+    # 三元組：依實際組合抽 (head type, relation, tail type)，各類型的實體以 Zipf 式分布抽取
+    patterns = rng.choice(len(reference.patterns), size=triples, p=reference.pattern_weights)
+    types = sorted({kind for head_type, _, tail_type in reference.patterns for kind in (head_type, tail_type)})
+    type_code = {kind: i for i, kind in enumerate(types)}
+    relations = sorted({relation for _, relation, _ in reference.patterns})
+    relation_code = {relation: i for i, relation in enumerate(relations)}
+    head_types = np.array([type_code[head_type] for head_type, _, _ in reference.patterns])[patterns]
+    tail_types = np.array([type_code[tail_type] for _, _, tail_type in reference.patterns])[patterns]
+    relation_ids = np.array([relation_code[relation] for _, relation, _ in reference.patterns])[patterns] + 1
+    pool = max(10, int(triples * ENTITY_RATIO / len(types)))
+
+    def draw(type_codes):
+        return type_codes.astype(np.int64) * pool + (pool * rng.random(len(type_codes)) ** 3).astype(np.int64)
+
+    heads, tails = draw(head_types), draw(tail_types)
+    used, inverse = np.unique(np.concatenate([heads, tails]), return_inverse=True)
+    head_ids, tail_ids = inverse[:triples] + 1, inverse[triples:] + 1
+
+    def entity_name(key):
+        kind = types[key // pool]
+        rank = key % pool
+        known = reference.names.get(kind, [])
+        if rank < len(known):
+            return known[rank], kind
+        return f'{ENTITY_PREFIX.get(kind, kind)}{rank}', kind
+
+    fts_trigger = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'triple_fts_insert'").fetchone()[0]
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO relation (id, name) VALUES (?, ?)', enumerate(relations, 1))
+    conn.executemany('INSERT INTO entity (id, name, type) VALUES (?, ?, ?)',
+                     ((i,) + entity_name(int(key)) for i, key in enumerate(used, 1)))
+    conn.executemany('INSERT INTO judgment (id, jid, region, year, category, number) VALUES (?, ?, ?, ?, ?, ?)',
+                     judgment_rows)
+    conn.execute('DROP TRIGGER triple_fts_insert')
+    judgment_ids = np.repeat(np.arange(1, len(counts) + 1), counts)
+    for start in range(0, triples, CHUNK):
+        chunk = slice(start, start + CHUNK)
+        conn.executemany('INSERT INTO triple (judgment_id, head_id, relation_id, tail_id) VALUES (?, ?, ?, ?)',
+                         zip(judgment_ids[chunk].tolist(), head_ids[chunk].tolist(),
+                             relation_ids[chunk].tolist(), tail_ids[chunk].tolist()))
+        progress(f'{path}: {min(start + CHUNK, triples)}/{triples} triples')
+    conn.execute("INSERT INTO triple_fts (triple_fts) VALUES ('rebuild')")
+    conn.execute(fts_trigger)
+    conn.execute('COMMIT')
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return {'triples': triples, 'judgments': len(counts), 'entities': len(used), 'relations': len(relations)}
+
+
+def corpus_dir(size, bench_dir=BENCH_DIR):
+    return os.path.join(bench_dir, size)
+
+
+def prepare_corpus(size, reference_path=DATABASE, bench_dir=BENCH_DIR, seed=0, force=False):
+    # 同樣大小與 seed 的資料庫已存在就直接使用；工作目錄的快取每次都清掉，量到的是冷啟動
+    workdir = corpus_dir(size, bench_dir)
+    meta_path = os.path.join(workdir, 'corpus.json')
+    key = {'version': GENERATOR_VERSION, 'triples': parse_size(size), 'seed': seed}
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        current = not force and meta['key'] == key and os.path.exists(os.path.join(workdir, 'CAMLKG.db'))
+    except (OSError, ValueError, KeyError):
+        current = False
+    os.makedirs(workdir, exist_ok=True)
+    if not current:
+        stats = generate_corpus(os.path.join(workdir, 'CAMLKG.db'), key['triples'], Reference(reference_path), seed,
+                                progress=lambda message: print(message, file=sys.stderr))
+        meta = {'key': key, 'corpus': stats}
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in WORKDIR_FILES:
+        target = os.path.join(workdir, name)
+        if not os.path.lexists(target):
+            os.symlink(os.path.join(here, name), target)
+    for name in CACHE_DIRS:
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    return workdir, meta['corpus']
+
+
+# ---- 量測 (在工作目錄中以 offscreen Qt 執行) ----
+
+def summarize(times):
+    ms = np.array(times) * 1000
+    warm = ms[1:] if len(ms) > 1 else ms
+    return {'runs': len(ms), 'first_ms': round(float(ms[0]), 3), 'min_ms': round(float(warm.min()), 3),
+            'median_ms': round(float(np.median(warm)), 3), 'mean_ms': round(float(warm.mean()), 3),
+            'p95_ms': round(float(np.percentile(warm, 95)), 3), 'max_ms': round(float(warm.max()), 3)}
+
+
+class Measure:
+    def __init__(self, repeat):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt6 import QtCore, QtWidgets
+        from PyQt6.QtWidgets import QMessageBox
+        # 與 CAMLKG.main 相同：QtWebEngine 在 QApplication 建立後才會被載入
+        QtCore.QCoreApplication.setAttribute(QtCore.Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+        self.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+        # 量測時不能被對話框擋住，訊息改為記錄下來
+        self.messages = []
+        QMessageBox.warning = lambda parent, title, text, *args: self.messages.append(text)
+        QMessageBox.exec = lambda box: self.messages.append(box.text())
+        self.repeat = repeat
+        self.results = {}
+        self.rng = np.random.default_rng(0)
+
+    def wait(self, key=None):
+        # 等待背景工作完成並把結果送回 GUI；key 為 None 時等待全部
+        tasks = self.window.tasks
+        while (key in tasks.latest) if key is not None else tasks.running:
+            self.app.processEvents()
+            time.sleep(0.0005)
+        self.app.processEvents()
+
+    def time(self, name, fn, setup=None, repeat=None):
+        times = []
+        for _ in range(repeat or self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        self.results[name] = summarize(times)
+        print(f'{name}: median {self.results[name]["median_ms"]} ms', file=sys.stderr)
+
+    def run(self, cases):
+        def startup():
+            # 包含載入模組的時間；只量測主視窗可以操作之前的部分，不等待背景工作
+            import CAMLKG
+            self.CAMLKG = CAMLKG
+            self.window = CAMLKG.MainWindow()
+            self.app.processEvents()
+
+        self.time('startup', startup, repeat=1)
+        self.wait()
+        CAMLKG = self.CAMLKG
+        from choropleth import choropleth_html
+        from database import fetch_jid
+        from geometry import geometry_service
+        window = self.window
+        jids = [row[0] for row in fetch_jid(window.conn)]
+        sample = [jids[i] for i in self.rng.integers(len(jids), size=self.repeat)]
+        picks = itertools.cycle(sample)
+
+        if 'fetch_jid' in cases:
+            self.time('fetch_jid', lambda: fetch_jid(window.conn))
+            # 依序輸入「法院 年度 字別 號數」，每個詞輸入完就篩選一次
+            index = window.jid_index
+            typed = iter([' '.join(index.fields(index.position(jid))[:n]) for jid in sample for n in range(1, 5)]
+                         * 2)
+
+            def jid_filter():
+                for _ in range(4):
+                    window.filterJids(next(typed))
+            self.time('jid_filter', jid_filter)
+
+        if 'search' in cases:
+            def search_jid():
+                window.JID_combo.setCurrentText(next(picks))
+                window.searchByJID()
+                self.wait('search')
+                window.tableView.grab()
+            self.time('search_jid', search_jid)
+
+            relation = window.conn.execute(
+                'SELECT r.name FROM triple t JOIN relation r ON r.id = t.relation_id '
+                'GROUP BY r.id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+
+            def search_keyword():
+                window.keyword_edit.setText(relation)
+                window.searchByKeyword()
+                self.wait('search')
+                window.tableView.grab()
+            self.time('search_keyword', search_keyword)
+
+        if 'paging' in cases and window.comboBox_page.count() > 1:
+            # 以最常見關係的搜尋結果翻頁，每次都重繪表格使資料真的被讀取
+            def page(handler):
+                def run():
+                    handler()
+                    window.tableView.grab()
+                return run
+            self.time('page_next', page(window.nextPage), setup=window.firstPage)
+            self.time('page_last', page(window.lastPage), setup=window.firstPage)
+            self.time('page_previous', page(window.previousPage), setup=window.lastPage)
+            self.time('page_first', page(window.firstPage), setup=window.lastPage)
+
+        if 'statistics' in cases:
+            self.time('load_cube', CAMLKG.load_cube)
+            years = [window.year_combo.itemText(i) for i in range(window.year_combo.count())]
+            year_picks = iter(years * self.repeat)
+
+            def statistics():
+                window.year_combo.setCurrentText(next(year_picks))
+                window.getStatistics()
+                self.app.processEvents()
+            self.time('statistics', statistics)
+            geojson = geometry_service().geojson(zoom=CAMLKG.MAP_ZOOM)
+            rows = window.cube.county_rows(years[-1])
+            self.time('map_html', lambda: choropleth_html(geojson, rows, CAMLKG.MAP_TITLE, zoom=CAMLKG.MAP_ZOOM))
+
+        if 'kg' in cases:
+            second = CAMLKG.SecondWindow(window)
+
+            def kg(jid):
+                def run():
+                    second.update_KG_view(jid)
+                    self.wait('kg')
+                    second.graphWidget.grab()
+                return run
+
+            def settle():
+                self.wait()
+            # 同一個判決重複量測：第一次包含版面配置計算，之後讀取快取
+            self.time('kg_layout', kg(sample[0]), setup=settle)
+            images = sorted(name[:-4] for name in os.listdir('images') if name.endswith('.png'))
+            known = set(jids)
+            png_only = [jid for jid in images if jid not in known]
+            if png_only:
+                self.time('kg_image', kg(png_only[0]), setup=settle)
+            self.wait()
+
+        if 'related' in cases:
+            from entity_graph import entity_index, related_judgments
+            from similarity import similar_judgments, similarity_index
+            from triple_store import triple_store
+            conn = window.conn
+            # 第一次呼叫時若索引尚未由 SecondWindow 建立，時間包含建立索引
+            self.time('entity_index', lambda: entity_index(conn), repeat=1)
+            self.time('triple_rows', lambda: triple_store(conn).rows(next(picks)).triples())
+            self.time('related_judgments', lambda: related_judgments(conn, next(picks), hops=2))
+            self.time('similarity_index', lambda: similarity_index(conn), repeat=1)
+            self.time('similar_judgments', lambda: similar_judgments(conn, next(picks)))
+        return self.results
+
+
+CASES = ('fetch_jid', 'search', 'paging', 'statistics', 'kg', 'related')
+
+
+# ---- 指令 ----
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(sizes, repeat=REPEAT, cases=CASES, reference=DATABASE, bench_dir=BENCH_DIR, out=None, seed=0):
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'sizes': {},
+    }
+    script = os.path.abspath(__file__)
+    for size in sizes:
+        workdir, corpus = prepare_corpus(size, reference, bench_dir, seed)
+        # 每個資料集用獨立的行程量測，避免前一個資料集的快取與連線影響結果
+        completed = subprocess.run([sys.executable, script, 'measure', '--repeat', str(repeat),
+                                    '--cases', *cases], cwd=workdir, stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            results['sizes'][size] = {'corpus': corpus, 'error': f'exit status {completed.returncode}'}
+            continue
+        results['sizes'][size] = {'corpus': corpus, 'cases': json.loads(completed.stdout)}
+
+    out = out or os.path.join(bench_dir, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(out)
+    return results
+
+
+def compare(before_path, after_path):
+    # 逐項比較兩次執行的中位數
+    with open(before_path, 'r', encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, 'r', encoding='utf-8') as f:
+        after = json.load(f)
+    print(f'{"size":>6} {"case":<20} {"before ms":>12} {"after ms":>12} {"change":>8}')
+    for size, result in after['sizes'].items():
+        previous = before['sizes'].get(size, {}).get('cases', {})
+        for case, timing in result.get('cases', {}).items():
+            old = previous.get(case, {}).get('median_ms')
+            new = timing['median_ms']
+            change = f'{(new - old) / old * 100:+.0f}%' if old else ''
+            print(f'{size:>6} {case:<20} {old if old is not None else "":>12} {new:>12} {change:>8}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the query, paging and rendering paths '
+                                                 'on synthetic corpora.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help='build a synthetic database')
+    generate.add_argument('size', help='number of triples, e.g. 10k, 1M')
+    generate.add_argument('--out', help=f'default: {BENCH_DIR}/SIZE/CAMLKG.db')
+    generate.add_argument('--reference', default=DATABASE, help='database to take distributions from')
+    generate.add_argument('--seed', type=int, default=0)
+    run_parser = commands.add_parser('run', help='generate corpora as needed and time every case')
+    run_parser.add_argument('sizes', nargs='*', default=list(SIZES[:2]))
+    run_parser.add_argument('--repeat', type=int, default=REPEAT)
+    run_parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    run_parser.add_argument('--reference', default=DATABASE)
+    run_parser.add_argument('--out', help=f'default: {BENCH_DIR}/results/TIMESTAMP.json')
+    run_parser.add_argument('--seed', type=int, default=0)
+    measure = commands.add_parser('measure', help='time the cases in the current directory (used by run)')
+    measure.add_argument('--repeat', type=int, default=REPEAT)
+    measure.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    compare_parser = commands.add_parser('compare', help='compare the medians of two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        if args.out:
+            print(generate_corpus(args.out, parse_size(args.size), Reference(args.reference), args.seed))
+        else:
+            print(prepare_corpus(args.size, args.reference, seed=args.seed, force=True))
+    elif args.command == 'run':
+        run(args.sizes, args.repeat, args.cases, args.reference, out=args.out, seed=args.seed)
+    elif args.command == 'measure':
+        json.dump(Measure(args.repeat).run(args.cases), sys.stdout)
+    else:
+        compare(args.before, args.after)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import json
+
+import folium
+
+from tracing import traced
+
+# 與 folium.Choropleth 預設相同的 YlOrRd 六級色階
+YLORRD = ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#f03b20', '#bd0026']
+
+LEGEND_HTML = '''
+<div id="choropleth-legend" style="position: fixed; bottom: 24px; right: 12px; z-index: 9999;
+     background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; padding: 6px;
+     font-size: 12px;"></div>
+'''
+
+# 頁面載入後由 updateChoropleth 以資料更新圖層樣式、提示與圖例；圖層變數在 folium 的 script 之後才宣告，
+# 所以只在函式內引用
+UPDATE_SCRIPT = '''
+var choroplethStyles = null;
+function updateChoropleth(data) {{
+    var choroplethLayer = {layer};
+    if (choroplethStyles === null) {{
+        choroplethStyles = {{}};
+        choroplethLayer.eachLayer(function (l) {{
+            l.on('mouseover', function () {{ l.setStyle({{weight: 3, fillColor: 'grey'}}); }});
+            l.on('mouseout', function () {{ l.setStyle(choroplethStyles[l.feature.properties.name]); }});
+        }});
+    }}
+    choroplethLayer.eachLayer(function (l) {{
+        var name = l.feature.properties.name;
+        var entry = data.counts[name] || [0, data.colors[0]];
+        l.feature.properties.Count = entry[0];
+        choroplethStyles[name] = {{color: 'black', weight: 0.5, opacity: 0.5,
+                                   fillColor: entry[1], fillOpacity: 0.7}};
+        l.setStyle(choroplethStyles[name]);
+        l.bindTooltip('<b>行政區</b> ' + name + '<br><b>判決數</b> ' + entry[0], {{sticky: false}});
+    }});
+    var legend = '<b>' + data.title + '</b>';
+    for (var i = 0; i < data.colors.length; i++) {{
+        legend += '<div><span style="display: inline-block; width: 14px; height: 10px; background: ' +
+                  data.colors[i] + '"></span> ' + data.breaks[i] + ' – ' + data.breaks[i + 1] + '</div>';
+    }}
+    document.getElementById('choropleth-legend').innerHTML = legend;
+}}
+'''
+
+
+def color_scale(counts, colors=YLORRD):
+    # 與 folium.Choropleth 相同，在最小值與最大值之間等距切分
+    low = min(counts, default=0)
+    high = max(counts, default=0)
+    step = (high - low) / len(colors) or 1
+    breaks = [round(low + step * i, 1) for i in range(len(colors) + 1)]
+    assigned = [colors[min(int((count - low) / step), len(colors) - 1)] for count in counts]
+    return breaks, assigned
+
+
+def choropleth_data(rows, title):
+    # rows: (City/County, Count, ...)，顏色在 Python 端算好，頁面只負責套用
+    names = [row[0] for row in rows]
+    counts = [row[1] for row in rows]
+    breaks, colors = color_scale(counts)
+    return {
+        'counts': {name: [count, color] for name, count, color in zip(names, counts, colors)},
+        'colors': YLORRD,
+        'breaks': breaks,
+        'title': title,
+    }
+
+
+def update_script(data):
+    return f'updateChoropleth({json.dumps(data, ensure_ascii=False)});'
+
+
+@traced('folium.choropleth_map')
+def choropleth_map(geojson, location=(23.73, 120.96), zoom=7):
+    m = folium.Map(location=list(location), zoom_start=zoom)
+    layer = folium.GeoJson(
+            data=geojson,
+            name='Count',
+            smooth_factor=2,
+            style_function=lambda x: {'color': 'black', 'weight': 0.5, 'fillColor': 'transparent'})
+    layer.add_to(m)
+    m.get_root().html.add_child(folium.Element(LEGEND_HTML))
+    m.get_root().script.add_child(folium.Element(UPDATE_SCRIPT.format(layer=layer.get_name())))
+    return m
+
+
+@traced('folium.choropleth_html')
+def choropleth_html(geojson, rows, title, location=(23.73, 120.96), zoom=7):
+    # 產生已填入資料的獨立 HTML，供匯出使用
+    m = choropleth_map(geojson, location, zoom)
+    m.get_root().script.add_child(folium.Element(
+        "window.addEventListener('load', function () { %s });" % update_script(choropleth_data(rows, title))))
+    return m.get_root().render()
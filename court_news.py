@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+NEWS_URL = "https://www.judicial.gov.tw/tw/lp-1888-{page}.html"
+CACHE_DIR = './cache/news'
+CACHE_TTL = 15 * 60
+PAGES = 3
+TIMEOUT = 10
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+
+def parse_news(html_content, url):
+    # 只解析新聞列表的 table，每列為 (標題, 發布日期, 發布單位) 與連結
+    table = BeautifulSoup(html_content, PARSER, parse_only=SoupStrainer('table', class_='table_sprite'))
+    rows = []
+    for row in table.find_all('tr')[1:]:
+        cells = row.find_all('td')
+        if len(cells) < 2 or cells[1].find('a') is None:
+            continue
+        row_data = [cell.get_text(strip=True) for cell in cells][1:]
+        href = cells[1].find('a').get('href')
+        rows.append((row_data, urljoin(url, href)))
+    return rows
+
+
+class NewsClient:
+    # 共用連線池的 Session，搭配磁碟快取：TTL 內直接使用快取，過期後以 ETag / Last-Modified 條件式請求
+    def __init__(self, url=NEWS_URL, cache_dir=CACHE_DIR, ttl=CACHE_TTL, pages=PAGES, timeout=TIMEOUT):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.pages = pages
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=pages, pool_maxsize=pages, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = 'JudgementVisualizeSystem'
+
+    def cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def read_cache(self, url):
+        try:
+            with open(self.cache_path(url), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_cache(self, url, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(url)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def fetch_page(self, page, force=False):
+        url = self.url.format(page=page)
+        cached = self.read_cache(url)
+        if cached is not None and not force and time.time() - cached['fetched_at'] < self.ttl:
+            return cached['rows']
+
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached is not None:
+                cached['fetched_at'] = time.time()
+                self.write_cache(url, cached)
+                return cached['rows']
+            response.raise_for_status()
+        except requests.RequestException:
+            # 連線失敗或伺服器錯誤時沿用過期的快取 (不更新 fetched_at，下次仍會重新請求)
+            if cached is None:
+                raise
+            return cached['rows']
+
+        rows = parse_news(response.content, url)
+        self.write_cache(url, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+            'rows': rows,
+        })
+        return rows
+
+    def fetch(self, force=False, progress=None):
+        # 同時抓取多個列表頁，依頁序合併並以連結去除重複
+        rows = []
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.pages) as executor:
+            futures = [executor.submit(self.fetch_page, page, force) for page in range(1, self.pages + 1)]
+            for done, future in enumerate(futures, 1):
+                for row_data, href in future.result():
+                    if href not in seen:
+                        seen.add(href)
+                        rows.append((list(row_data), href))
+                if progress is not None:
+                    progress(done * 100 // len(futures))
+        return rows
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+
+
+def news_client():
+    global _client
+    if _client is None:
+        _client = NewsClient(url=os.environ.get('CAMLKG_NEWS_URL', NEWS_URL))
+    return _client
+
+
+# 離線測試用的本地伺服器，產生與司法院新聞列表相同結構的頁面並支援條件式請求
+def fixture_page(page, rows_per_page=15):
+    rows = []
+    for i in range(rows_per_page):
+        n = (page - 1) * rows_per_page + i + 1
+        rows.append(f'<tr><td>{n}</td><td><a href="/tw/cp-1888-{n}.html">法院新聞稿 {n}</a></td>'
+                    f'<td>113-01-{n % 28 + 1:02d}</td><td>司法院</td></tr>')
+    return ('<html><body><table class="table_sprite"><tr><th>序號</th><th>標題</th><th>發布日期</th>'
+            f'<th>發布單位</th></tr>{"".join(rows)}</table></body></html>')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+        body = server.pages.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+        if 'If-None-Match' in self.headers:
+            not_modified = self.headers['If-None-Match'] == etag
+        else:
+            not_modified = self.headers.get('If-Modified-Since') == server.last_modified
+        if not_modified:
+            with server.lock:
+                server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class NewsFixtureServer:
+    def __init__(self, pages=PAGES, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.pages = {f'/tw/lp-1888-{page}.html': fixture_page(page) for page in range(1, pages + 1)}
+        self.httpd.requests = []
+        self.httpd.not_modified = 0
+        self.httpd.lock = threading.Lock()
+        self.httpd.last_modified = formatdate(usegmt=True)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/tw/lp-1888-{{page}}.html'
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def setPage(self, page, body):
+        self.httpd.pages[f'/tw/lp-1888-{page}.html'] = body
+        self.httpd.last_modified = formatdate(usegmt=True)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def self_check():
+    # 以本地伺服器檢查 NewsClient：TTL 內沿用快取、過期後的 304、頁面變動後的差異、伺服器停止後沿用過期快取
+    with tempfile.TemporaryDirectory() as cache_dir, NewsFixtureServer() as server:
+        client = NewsClient(url=server.url, cache_dir=cache_dir)
+        rows = client.fetch()
+        expect(len(server.requests) == PAGES, f'first fetch: {len(server.requests)} requests')
+        expect(len(rows) == PAGES * 15, f'first fetch: {len(rows)} rows')
+
+        expect(client.fetch() == rows and len(server.requests) == PAGES, 'fetch within the TTL hit the server')
+
+        client.ttl = 0
+        expect(client.fetch() == rows, 'rows changed after 304')
+        expect(len(server.requests) == 2 * PAGES and server.httpd.not_modified == PAGES,
+               f'expired fetch: {len(server.requests)} requests, {server.httpd.not_modified} not modified')
+
+        # 第 2 頁換掉一則新聞並修改另一則的標題，其餘頁仍為 304
+        body = fixture_page(2).replace('法院新聞稿 16<', '法院新聞稿 16 (更正)<')
+        server.setPage(2, body.replace('/tw/cp-1888-17.html', '/tw/cp-1888-99.html'))
+        changed = client.fetch()
+        expect(server.httpd.not_modified == 2 * PAGES - 1, f'{server.httpd.not_modified} not modified')
+        before = {href: row_data for row_data, href in rows}
+        after = {href: row_data for row_data, href in changed}
+        removed = sorted(set(before) - set(after))
+        added = sorted(set(after) - set(before))
+        edited = sorted(href for href in set(before) & set(after) if before[href] != after[href])
+        expect([href.rsplit('/', 1)[1] for href in removed] == ['cp-1888-17.html'], f'removed rows: {removed}')
+        expect([href.rsplit('/', 1)[1] for href in added] == ['cp-1888-99.html'], f'added rows: {added}')
+        expect([href.rsplit('/', 1)[1] for href in edited] == ['cp-1888-16.html'], f'edited rows: {edited}')
+
+        # 重試用完後仍連不上，回傳上一次的結果
+        server.stop()
+        expect(client.fetch() == changed, 'stale rows were not used while the server was down')
+        client.close()
+    print('court_news: ok')
+
+
+if __name__ == '__main__':
+    # python court_news.py check：以本地伺服器檢查快取與條件式請求
+    # python court_news.py [port]：啟動本地新聞伺服器，設定 CAMLKG_NEWS_URL 為印出的網址即可離線測試
+    if sys.argv[1:2] == ['check']:
+        self_check()
+        sys.exit(0)
+    server = NewsFixtureServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(server.url)
+    server.httpd.serve_forever()
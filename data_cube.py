@@ -0,0 +1,86 @@
+import numpy as np
+
+from tracing import traced
+from triple_store import triple_store
+
+AXES = ('year', 'region', 'category')
+
+
+class DataCube:
+    # year × region × category 的判決數，由 TripleStore 的判決欄位一次計數；切片、彙總與年增減都只在記憶體中計算
+    def __init__(self, years, regions, categories, counts, counties, county_sns, region_county):
+        self.years = years
+        self.regions = regions
+        self.categories = categories
+        self.counts = counts
+        self.counties = counties
+        self.county_sns = county_sns
+        # region -> 縣市的對應矩陣 (R × 縣市數)，沒有對應縣市的法院整列為 0
+        self.region_county = region_county
+        self._index = {axis: {value: i for i, value in enumerate(values)}
+                       for axis, values in zip(AXES, (years, regions, categories))}
+
+    @classmethod
+    @traced('cube.build')
+    def build(cls, conn):
+        # 每個判決的年度 / 法院 / 類別取自 TripleStore 的字串編號，只在整數上計數
+        store = triple_store(conn)
+        labels, positions = [], []
+        for axis in AXES:
+            ids, inverse = np.unique(store.judgment_columns[axis], return_inverse=True)
+            names = store.strings.lookup(ids)
+            order = sorted(range(len(names)), key=names.__getitem__)
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            labels.append([names[i] for i in order])
+            positions.append(rank[inverse.reshape(-1)])
+        shape = [len(values) for values in labels]
+        flat = np.ravel_multi_index(positions, shape) if all(shape) else np.zeros(0, dtype=np.int64)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).astype(np.int32).reshape(shape)
+        index = [{value: i for i, value in enumerate(values)} for values in labels]
+
+        counties = conn.execute('SELECT name, sn FROM county ORDER BY rowid').fetchall()
+        county_index = {name: i for i, (name, _) in enumerate(counties)}
+        region_county = np.zeros((len(labels[1]), len(counties)), dtype=np.int32)
+        for region, county in conn.execute('SELECT region, county FROM court_county'):
+            if region in index[1] and county in county_index:
+                region_county[index[1][region], county_index[county]] = 1
+        return cls(*labels, counts, [name for name, _ in counties], [sn for _, sn in counties], region_county)
+
+    def positions(self, axis, values):
+        # None 表示整個軸；不存在的值直接略過
+        if values is None:
+            return slice(None)
+        if isinstance(values, str):
+            values = [values]
+        lookup = self._index[axis]
+        return [lookup[value] for value in values if value in lookup]
+
+    def select(self, years=None, regions=None, categories=None):
+        counts = self.counts[self.positions('year', years)]
+        counts = counts[:, self.positions('region', regions)]
+        return counts[:, :, self.positions('category', categories)]
+
+    def rollup(self, keep, years=None, regions=None, categories=None):
+        # 只保留 keep 中的軸，其餘加總，例如 rollup(('year',)) 為逐年總數
+        axes = tuple(i for i, axis in enumerate(AXES) if axis not in keep)
+        return self.select(years, regions, categories).sum(axis=axes)
+
+    def series(self, regions=None, categories=None):
+        # 逐年判決數，對應 self.years
+        return self.rollup(('year',), regions=regions, categories=categories)
+
+    def yoy(self, regions=None, categories=None):
+        # 年增減 (件數, 百分比)，第一年與前一年為 0 件時百分比為 nan
+        series = self.series(regions, categories)
+        delta = np.diff(series, prepend=series[:1])
+        previous = np.concatenate([[0], series[:-1]]).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.where(previous > 0, delta / previous * 100, np.nan)
+        return delta, percent
+
+    def county_rows(self, year, categories=None):
+        # 與 database.county_statistics 相同格式的 (City/County, Count, CountySN)
+        by_region = self.rollup(('region',), years=year, categories=categories)
+        by_county = by_region @ self.region_county
+        return [(name, int(count), sn) for name, count, sn in zip(self.counties, by_county, self.county_sns)]
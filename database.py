@@ -0,0 +1,341 @@
+import sqlite3
+import threading
+from sqlite3 import Error
+
+from tracing import traced
+
+DATABASE = './CAMLKG.db'
+
+def create_connection(db_file):
+    # migration 失敗時直接拋出，不回傳還沒有新 schema 的連線 (之後的查詢只會以 no such table 失敗)
+    conn = sqlite3.connect(db_file)
+    try:
+        migrate(conn)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+# caml 原本是一張全為 TEXT 欄位的平面表，v1 將其拆成字典編碼的 entity / relation / judgment
+# 與只存整數 key 的 triple，caml 改為相容的 view，既有的 SELECT 不需修改。
+# 舊的 caml 欄位都可為 NULL：實體、關係與 JID 的 NULL 轉成空字串 (查詢結果與原本的 NULL 同樣顯示為空白)，
+# 判決的 region / year / category / number 保留 NULL，由讀取端自 JID 推得
+SCHEMA_V1 = """
+CREATE TABLE entity (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    UNIQUE (name, type)
+);
+CREATE TABLE relation (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE judgment (
+    id INTEGER PRIMARY KEY,
+    jid TEXT NOT NULL UNIQUE,
+    region TEXT,
+    year TEXT,
+    category TEXT,
+    number TEXT
+);
+CREATE TABLE triple (
+    id INTEGER PRIMARY KEY,
+    judgment_id INTEGER NOT NULL REFERENCES judgment (id),
+    head_id INTEGER NOT NULL REFERENCES entity (id),
+    relation_id INTEGER NOT NULL REFERENCES relation (id),
+    tail_id INTEGER NOT NULL REFERENCES entity (id)
+);
+CREATE INDEX idx_judgment_year ON judgment (year);
+CREATE INDEX idx_judgment_region ON judgment (region);
+CREATE INDEX idx_judgment_category ON judgment (category);
+CREATE INDEX idx_triple_judgment ON triple (judgment_id);
+
+INSERT INTO entity (name, type)
+    SELECT COALESCE("head entity", ''), COALESCE("head entity type", '') FROM caml_v0
+    UNION
+    SELECT COALESCE("tail entity", ''), COALESCE("tail entity type", '') FROM caml_v0;
+INSERT INTO relation (name) SELECT DISTINCT COALESCE(relation, '') FROM caml_v0;
+INSERT INTO judgment (jid, region, year, category, number)
+    SELECT COALESCE(JID, ''), region, year, category, number FROM caml_v0
+    GROUP BY COALESCE(JID, '') ORDER BY MIN(rowid);
+INSERT INTO triple (judgment_id, head_id, relation_id, tail_id)
+    SELECT j.id, h.id, r.id, t.id
+    FROM caml_v0 c
+    JOIN judgment j ON j.jid = COALESCE(c.JID, '')
+    JOIN entity h ON h.name = COALESCE(c."head entity", '') AND h.type = COALESCE(c."head entity type", '')
+    JOIN relation r ON r.name = COALESCE(c.relation, '')
+    JOIN entity t ON t.name = COALESCE(c."tail entity", '') AND t.type = COALESCE(c."tail entity type", '')
+    ORDER BY c.rowid;
+DROP TABLE caml_v0;
+
+CREATE VIEW caml_rows AS
+    SELECT t.id AS _key,
+           h.type AS "head entity type",
+           h.name AS "head entity",
+           r.name AS relation,
+           ta.name AS "tail entity",
+           ta.type AS "tail entity type",
+           j.jid AS JID,
+           j.region AS region,
+           j.year AS year,
+           j.category AS category,
+           j.number AS number
+    FROM triple t
+    JOIN judgment j ON j.id = t.judgment_id
+    JOIN entity h ON h.id = t.head_id
+    JOIN relation r ON r.id = t.relation_id
+    JOIN entity ta ON ta.id = t.tail_id;
+CREATE VIEW caml AS
+    SELECT "head entity type", "head entity", relation, "tail entity", "tail entity type",
+           JID, region, year, category, number
+    FROM caml_rows;
+"""
+
+def execute_script(conn, script):
+    # executescript() 會先 COMMIT，migration 需要在同一個交易內逐句執行
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                conn.execute(statement)
+            statement = ''
+
+def migrate_v1(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS caml (
+        "head entity type" TEXT, "head entity" TEXT, "relation" TEXT, "tail entity" TEXT,
+        "tail entity type" TEXT, "JID" TEXT, "region" TEXT, "year" TEXT, "category" TEXT, "number" TEXT)""")
+    conn.execute("ALTER TABLE caml RENAME TO caml_v0")
+    execute_script(conn, SCHEMA_V1)
+
+# v2：由 judgment 聚合出 year × region × category 的判決數，並以 trigger 隨 judgment 增刪即時更新，
+# 取代手動維護的 '107' ~ '110' 統計表
+# judgment 的 year / region / category 可為 NULL，統計表以空字串代替
+SCHEMA_V2 = """
+CREATE TABLE county (
+    name TEXT PRIMARY KEY,
+    sn INTEGER NOT NULL
+);
+CREATE TABLE court_county (
+    region TEXT PRIMARY KEY,
+    county TEXT NOT NULL REFERENCES county (name)
+);
+CREATE TABLE judgment_stats (
+    year TEXT NOT NULL,
+    region TEXT NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (year, region, category)
+) WITHOUT ROWID;
+INSERT INTO judgment_stats (year, region, category, count)
+    SELECT COALESCE(year, ''), COALESCE(region, ''), COALESCE(category, ''), COUNT(*) FROM judgment
+    GROUP BY 1, 2, 3;
+
+CREATE TRIGGER judgment_stats_insert AFTER INSERT ON judgment BEGIN
+    INSERT INTO judgment_stats (year, region, category, count)
+        VALUES (COALESCE(NEW.year, ''), COALESCE(NEW.region, ''), COALESCE(NEW.category, ''), 1)
+        ON CONFLICT (year, region, category) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER judgment_stats_delete AFTER DELETE ON judgment BEGIN
+    UPDATE judgment_stats SET count = count - 1
+        WHERE year = COALESCE(OLD.year, '') AND region = COALESCE(OLD.region, '')
+          AND category = COALESCE(OLD.category, '');
+    DELETE FROM judgment_stats
+        WHERE year = COALESCE(OLD.year, '') AND region = COALESCE(OLD.region, '')
+          AND category = COALESCE(OLD.category, '') AND count <= 0;
+END;
+CREATE TRIGGER judgment_stats_update AFTER UPDATE OF year, region, category ON judgment BEGIN
+    UPDATE judgment_stats SET count = count - 1
+        WHERE year = COALESCE(OLD.year, '') AND region = COALESCE(OLD.region, '')
+          AND category = COALESCE(OLD.category, '');
+    DELETE FROM judgment_stats
+        WHERE year = COALESCE(OLD.year, '') AND region = COALESCE(OLD.region, '')
+          AND category = COALESCE(OLD.category, '') AND count <= 0;
+    INSERT INTO judgment_stats (year, region, category, count)
+        VALUES (COALESCE(NEW.year, ''), COALESCE(NEW.region, ''), COALESCE(NEW.category, ''), 1)
+        ON CONFLICT (year, region, category) DO UPDATE SET count = count + 1;
+END;
+"""
+
+COUNTIES = [
+    ('新北市', 10001001), ('台北市', 63000001), ('桃園市', 10003001), ('台中市', 10006001),
+    ('台南市', 10011001), ('高雄市', 10012001), ('宜蘭縣', 10002001), ('新竹縣', 10004001),
+    ('苗栗縣', 10005001), ('彰化縣', 10007001), ('南投縣', 10008001), ('雲林縣', 10009001),
+    ('嘉義縣', 10010001), ('屏東縣', 10013001), ('台東縣', 10014001), ('花蓮縣', 10015001),
+    ('澎湖縣', 10016001), ('基隆市', 10017001), ('新竹市', 10018001), ('嘉義市', 10020001),
+    ('金門縣', 9020001), ('連江縣', 9007001),
+]
+
+# 判決的 region 是法院名稱，依法院所在地對應到縣市 (嘉義地方法院在嘉義市、新竹地方法院在竹北、
+# 臺灣高等法院在台北市)。原本附帶的 107~110 統計表對同一法院並不一致，無法以單一對應重現，
+# 與舊表相比有變動的縣市 (107 年相同)：
+#   108 年：臺灣高等法院 1 件由台中市改為台北市 (台北市 1→2、台中市 3→2)，
+#           新竹 1 件由新竹市改為新竹縣 (新竹市 1→0、新竹縣 0→1)
+#   109 年：嘉義 4 件由嘉義縣改為嘉義市 (嘉義縣 4→0、嘉義市 0→4)
+#   110 年：舊表漏算 3 件 (臺灣高等法院 2 件、臺中 1 件)，台北市 26→28、台中市 23→24
+COURT_COUNTY = {
+    '臺北': '台北市', '士林': '台北市', '臺灣高等法院': '台北市', '新北': '新北市',
+    '桃園': '桃園市', '臺中': '台中市', '臺南': '台南市', '高雄': '高雄市', '橋頭': '高雄市',
+    '宜蘭': '宜蘭縣', '新竹': '新竹縣', '苗栗': '苗栗縣', '彰化': '彰化縣', '南投': '南投縣',
+    '雲林': '雲林縣', '嘉義': '嘉義市', '屏東': '屏東縣', '臺東': '台東縣', '花蓮': '花蓮縣',
+    '澎湖': '澎湖縣', '基隆': '基隆市', '福建金門地方法院': '金門縣', '福建連江地方法院': '連江縣',
+}
+
+def migrate_v2(conn):
+    execute_script(conn, SCHEMA_V2)
+    conn.executemany("INSERT INTO county (name, sn) VALUES (?, ?)", COUNTIES)
+    conn.executemany("INSERT INTO court_county (region, county) VALUES (?, ?)", COURT_COUNTY.items())
+
+# v3：以 trigram tokenizer 建立三元組的全文檢索 (中文不需斷詞)，內容由 triple_text view 提供，
+# 由 triple 的 trigger 同步；另外為實體與關係的反查加上索引
+SCHEMA_V3 = """
+CREATE INDEX idx_triple_head ON triple (head_id);
+CREATE INDEX idx_triple_tail ON triple (tail_id);
+CREATE INDEX idx_triple_relation ON triple (relation_id);
+
+CREATE VIEW triple_text AS
+    SELECT t.id AS id, h.type AS head_type, h.name AS head, r.name AS relation,
+           ta.name AS tail, ta.type AS tail_type
+    FROM triple t
+    JOIN entity h ON h.id = t.head_id
+    JOIN relation r ON r.id = t.relation_id
+    JOIN entity ta ON ta.id = t.tail_id;
+CREATE VIRTUAL TABLE triple_fts USING fts5 (
+    head_type, head, relation, tail, tail_type,
+    content = 'triple_text', content_rowid = 'id', tokenize = 'trigram'
+);
+INSERT INTO triple_fts (triple_fts) VALUES ('rebuild');
+
+CREATE TRIGGER triple_fts_insert AFTER INSERT ON triple BEGIN
+    INSERT INTO triple_fts (rowid, head_type, head, relation, tail, tail_type)
+        SELECT id, head_type, head, relation, tail, tail_type FROM triple_text WHERE id = NEW.id;
+END;
+CREATE TRIGGER triple_fts_delete AFTER DELETE ON triple BEGIN
+    INSERT INTO triple_fts (triple_fts, rowid, head_type, head, relation, tail, tail_type)
+        SELECT 'delete', OLD.id, h.type, h.name, r.name, ta.name, ta.type
+        FROM entity h, relation r, entity ta
+        WHERE h.id = OLD.head_id AND r.id = OLD.relation_id AND ta.id = OLD.tail_id;
+END;
+"""
+
+def migrate_v3(conn):
+    execute_script(conn, SCHEMA_V3)
+
+# 依 PRAGMA user_version 依序執行尚未套用的 migration
+MIGRATIONS = [migrate_v1, migrate_v2, migrate_v3]
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # 等待寫入鎖的期間可能已由其他程序完成 migration，取得鎖後重新讀取版本
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        conn.execute("COMMIT")
+    except Error:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = ''
+
+@traced('sql.fetch_jid')
+def fetch_jid(conn):
+    cur = conn.cursor()
+    sql = "select jid from judgment order by jid"
+    cur.execute(sql)
+    rows = cur.fetchall()
+    return rows
+
+@traced('sql.county_statistics')
+def county_statistics(conn, years=None, categories=None):
+    # 回傳每個縣市 (City/County, Count, CountySN)，years / categories 為 None 時不篩選
+    conditions = []
+    params = []
+    for column, values in (('year', years), ('category', categories)):
+        if values is not None:
+            values = [str(value) for value in values]
+            conditions.append(f"s.{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    on = ''.join(f' AND {condition}' for condition in conditions)
+    sql = f"""SELECT c.name, COALESCE(SUM(s.count), 0), c.sn
+              FROM county c
+              LEFT JOIN court_county cc ON cc.county = c.name
+              LEFT JOIN judgment_stats s ON s.region = cc.region{on}
+              GROUP BY c.name
+              ORDER BY c.rowid"""
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    return rows
+
+SEARCH_LIMIT = 1000
+SEARCH_COLUMNS = ('c."head entity type", c."head entity", c.relation, c."tail entity", c."tail entity type", '
+                  'c.JID, c.region, c.year, c.category, c.number')
+
+def search_query(text):
+    # 回傳可交給 TableModel 的 (sql, params)；trigram 至少需要 3 個字，較短的關鍵字改查實體與關係字典
+    terms = text.split()
+    if terms and all(len(term) >= 3 for term in terms):
+        match = ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        sql = f"""WITH hits AS (
+                      SELECT rowid AS triple_id, rank,
+                             snippet(triple_fts, -1, '【', '】', '…', 12) AS snippet
+                      FROM triple_fts WHERE triple_fts MATCH ?
+                      ORDER BY rank LIMIT {SEARCH_LIMIT}
+                  )
+                  SELECT ROW_NUMBER() OVER (ORDER BY h.rank, h.triple_id) AS _key,
+                         h.snippet AS "match", {SEARCH_COLUMNS}
+                  FROM hits h JOIN caml_rows c ON c._key = h.triple_id"""
+        return sql, (match,)
+
+    conditions = []
+    params = []
+    for term in terms:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append("""(t.head_id IN (SELECT id FROM entity WHERE name LIKE ? ESCAPE '\\' OR type LIKE ? ESCAPE '\\')
+                              OR t.tail_id IN (SELECT id FROM entity WHERE name LIKE ? ESCAPE '\\' OR type LIKE ? ESCAPE '\\')
+                              OR t.relation_id IN (SELECT id FROM relation WHERE name LIKE ? ESCAPE '\\'))""")
+        params.extend([pattern] * 5)
+    where = ' AND '.join(conditions) or '0'
+    # 與全文檢索相同最多 SEARCH_LIMIT 筆，常見的短詞 (例如 被告) 會符合數十萬筆三元組
+    sql = f"""WITH hits AS (
+                  SELECT t.id AS triple_id FROM triple t
+                  WHERE {where}
+                  ORDER BY t.id LIMIT {SEARCH_LIMIT}
+              )
+              SELECT c._key AS _key, NULL AS "match", {SEARCH_COLUMNS}
+              FROM hits h JOIN caml_rows c ON c._key = h.triple_id"""
+    return sql, tuple(params)
+
+def statistics_query(region=None, category=None):
+    # 逐年、逐法院、逐類別判決數的 (sql, params)，region / category 為 None 時不篩選
+    conditions, params = [], []
+    for column, value in (('region', region), ('category', category)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f"SELECT year, region, category, count FROM judgment_stats{where} ORDER BY year, region, category", params
+
+@traced('sql.fetch_year')
+def fetch_year(conn):
+    cur = conn.cursor()
+    sql = "select distinct year from judgment_stats where year != '' order by year"
+    cur.execute(sql)
+    rows = cur.fetchall()
+    return rows
+
+_local = threading.local()
+
+def thread_connection(database=DATABASE):
+    # sqlite3 連線不能跨執行緒使用，背景工作各自在所屬執行緒建立一次連線
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = create_connection(database)
+    return conn
@@ -0,0 +1,200 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from tracing import traced
+
+INDEX_PATH = './cache/entity_index.npz'
+INDEX_VERSION = 1
+# 出現在太多判決的實體 (例如洗錢防制法) 幾乎連到所有判決，多跳查詢時不經由它們擴展
+HUB_DEGREE = 50
+# 每個執行緒保留最近幾個連線的 database_stamp (sqlite3 連線只在建立它的執行緒使用)
+STAMP_CACHE = 8
+
+_stamps = threading.local()
+
+
+def gather(indptr, indices, rows):
+    # 一次取出 CSR 多列的內容，不在 Python 迴圈中逐列切片
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=indices.dtype), lengths
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)], lengths
+
+
+def to_csr(rows, cols, n_rows):
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32)
+
+
+def database_stamp(conn):
+    # 以各表的筆數與最大 id 判斷索引是否仍對應目前的資料庫。COUNT(*) 要掃過整張表 (百萬筆約 80 ms)，
+    # 所以只在資料庫有變動時重算：PRAGMA data_version 在其他連線 commit 後改變，
+    # total_changes 涵蓋這個連線自己的寫入，兩者都沒變時沿用上次的結果
+    version = (conn.execute('PRAGMA data_version').fetchone()[0], conn.total_changes)
+    stamps = getattr(_stamps, 'cache', None)
+    if stamps is None:
+        stamps = _stamps.cache = OrderedDict()
+    cached = stamps.get(id(conn))
+    # 保留連線本身的參照，避免連線被回收後 id 被新連線重用
+    if cached is not None and cached[0] is conn and cached[1] == version:
+        stamps.move_to_end(id(conn))
+        return cached[2]
+    stamp = [INDEX_VERSION]
+    for table in ('judgment', 'entity', 'triple'):
+        stamp.extend(conn.execute(f'SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table}').fetchone())
+    stamp = np.array(stamp, dtype=np.int64)
+    stamps[id(conn)] = (conn, version, stamp)
+    stamps.move_to_end(id(conn))
+    if len(stamps) > STAMP_CACHE:
+        stamps.popitem(last=False)
+    return stamp
+
+
+class EntityIndex:
+    # 判決與實體的二部圖：judgment -> entity 與 entity -> judgment 兩份 CSR，
+    # 列與欄都是位置編號，judgment_ids / entity_ids 對回資料庫的 id
+    def __init__(self, judgment_ids, entity_ids, indptr, indices, stamp):
+        self.judgment_ids = judgment_ids
+        self.entity_ids = entity_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.stamp = stamp
+        rows = np.repeat(np.arange(len(judgment_ids), dtype=np.int32), np.diff(indptr))
+        self.entity_indptr, self.entity_indices = to_csr(indices, rows, len(entity_ids))
+        self.degree = np.diff(self.entity_indptr)
+        self._positions = {id: i for i, id in enumerate(judgment_ids.tolist())}
+
+    @classmethod
+    @traced('index.entity_build')
+    def build(cls, conn):
+        stamp = database_stamp(conn)
+        pairs = np.array(conn.execute(
+            'SELECT judgment_id, head_id FROM triple UNION SELECT judgment_id, tail_id FROM triple').fetchall(),
+            dtype=np.int64).reshape(-1, 2)
+        judgment_ids = np.array([row[0] for row in conn.execute('SELECT id FROM judgment ORDER BY id')],
+                                dtype=np.int64)
+        entity_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+        rows = np.searchsorted(judgment_ids, pairs[:, 0])
+        indptr, indices = to_csr(rows, cols.astype(np.int32), len(judgment_ids))
+        return cls(judgment_ids, entity_ids, indptr, indices, stamp)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['judgment_ids'], data['entity_ids'], data['indptr'], data['indices'], data['stamp'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp_path, judgment_ids=self.judgment_ids, entity_ids=self.entity_ids,
+                 indptr=self.indptr, indices=self.indices, stamp=self.stamp)
+        os.replace(tmp_path, path)
+
+    def position(self, judgment_id):
+        return self._positions.get(judgment_id)
+
+    def entities(self, position):
+        return self.indices[self.indptr[position]:self.indptr[position + 1]]
+
+    def related(self, position, limit=20):
+        # 共同實體以 idf 加權計分，越少判決共有的實體越有代表性；回傳 (位置, 分數, 共同實體數)
+        entities = self.entities(position)
+        idf = np.log(len(self.judgment_ids) / np.maximum(self.degree[entities], 1))
+        judgments, lengths = gather(self.entity_indptr, self.entity_indices, entities)
+        n = len(self.judgment_ids)
+        scores = np.bincount(judgments, weights=np.repeat(idf, lengths), minlength=n)
+        shared = np.bincount(judgments, minlength=n)
+        scores[position] = 0
+        shared[position] = 0
+        candidates = np.flatnonzero(shared)
+        top = candidates[np.lexsort((candidates, -scores[candidates]))][:limit]
+        return [(int(j), float(scores[j]), int(shared[j])) for j in top]
+
+    def neighborhood(self, position, hops=2, max_degree=HUB_DEGREE):
+        # 判決 -> 實體 -> 判決 為一跳的廣度優先搜尋，回傳 {位置: 跳數}，不含起點
+        hop = np.full(len(self.judgment_ids), -1, dtype=np.int32)
+        hop[position] = 0
+        usable = self.degree <= max_degree if max_degree is not None else np.ones(len(self.degree), bool)
+        frontier = np.array([position])
+        for step in range(1, hops + 1):
+            entities, _ = gather(self.indptr, self.indices, frontier)
+            entities = np.unique(entities[usable[entities]])
+            judgments, _ = gather(self.entity_indptr, self.entity_indices, entities)
+            judgments = np.unique(judgments)
+            frontier = judgments[hop[judgments] < 0]
+            if len(frontier) == 0:
+                break
+            hop[frontier] = step
+        reached = np.flatnonzero(hop > 0)
+        return dict(zip(reached.tolist(), hop[reached].tolist()))
+
+    def shared_entities(self, a, b):
+        return np.intersect1d(self.entities(a), self.entities(b), assume_unique=True)
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def entity_index(conn, path=INDEX_PATH):
+    # 資料庫沒有變動時沿用記憶體或磁碟上的索引，否則重新建立並寫回磁碟
+    global _index
+    stamp = database_stamp(conn)
+    with _lock:
+        if _index is not None and np.array_equal(_index.stamp, stamp):
+            return _index
+        try:
+            index = EntityIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is None or not np.array_equal(index.stamp, stamp):
+            index = EntityIndex.build(conn)
+            index.save(path)
+        _index = index
+        return index
+
+
+@traced('index.related')
+def related_judgments(conn, jid, hops=1, limit=50, shared_names=3):
+    # 供 SecondWindow 顯示：(JID, 跳數, 分數, 共同實體)；一跳依共同實體分數排序，
+    # 更遠的判決沒有直接共同的實體，不計分，每一跳各取 limit 筆
+    row = conn.execute('SELECT id FROM judgment WHERE jid = ?', (jid,)).fetchone()
+    index = entity_index(conn)
+    position = index.position(row[0]) if row else None
+    if position is None:
+        return []
+    results = [(j, 1, round(score, 2)) for j, score, _ in index.related(position, limit)]
+    if hops > 1:
+        # 一跳的排序含常見實體，多跳時不經由它們擴展，同一判決只列一次
+        found = {j for j, _, _ in results}
+        reached = index.neighborhood(position, hops)
+        for hop in range(2, hops + 1):
+            farther = sorted(j for j, h in reached.items() if h == hop and j not in found)
+            results.extend((j, hop, '') for j in farther[:limit])
+    if not results:
+        return []
+
+    ids = [int(index.judgment_ids[j]) for j, _, _ in results]
+    placeholders = ', '.join('?' * len(ids))
+    jids = dict(conn.execute(f'SELECT id, jid FROM judgment WHERE id IN ({placeholders})', ids))
+    rows = []
+    for (j, hop, score), id in zip(results, ids):
+        names = []
+        if hop == 1:
+            # 以 idf 最高 (最少判決共有) 的實體作為說明
+            shared = index.shared_entities(position, j)
+            shared = shared[np.argsort(index.degree[shared], kind='stable')][:shared_names]
+            entity_ids = index.entity_ids[shared].tolist()
+            placeholders = ', '.join('?' * len(entity_ids))
+            lookup = dict(conn.execute(f'SELECT id, name FROM entity WHERE id IN ({placeholders})', entity_ids))
+            names = [lookup[e] for e in entity_ids]
+        rows.append((jids[id], hop, score, '、'.join(names)))
+    return rows
@@ -0,0 +1,119 @@
+import json
+import os
+import pickle
+import threading
+
+import geopandas as gpd
+from shapely import wkb
+from shapely.geometry import shape
+
+from tracing import traced
+
+GEOJSON_PATH = './geo_taiwan_short.json'
+CACHE_PATH = './cache/geo_taiwan_short.pkl'
+CACHE_VERSION = 1
+# 預先簡化的縮放層級，容許誤差約為該層級一個像素對應的經緯度
+ZOOM_LEVELS = (7, 9, 11)
+
+
+def pixel_degrees(zoom):
+    return 360.0 / (256 * 2 ** zoom)
+
+
+class GeometryService:
+    # 縣市界線只讀一次，各縮放層級的簡化結果以 WKB 快取在磁碟上
+    def __init__(self, path=GEOJSON_PATH, cache_path=CACHE_PATH, zoom_levels=ZOOM_LEVELS):
+        self.path = path
+        self.cache_path = cache_path
+        self.zoom_levels = tuple(sorted(zoom_levels))
+        self.names = None
+        self.sns = None
+        self.levels = None
+        self._frames = {}
+        self._geojson = {}
+        self._lock = threading.Lock()
+
+    def _source_stamp(self):
+        stat = os.stat(self.path)
+        return CACHE_VERSION, stat.st_size, stat.st_mtime_ns, self.zoom_levels
+
+    def _load(self):
+        if self.levels is not None:
+            return
+        with self._lock:
+            if self.levels is None:
+                self._read()
+
+    @traced('geometry.load')
+    def _read(self):
+        stamp = self._source_stamp()
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['stamp'] == stamp:
+                self.names, self.sns, self.levels = cached['names'], cached['sns'], cached['levels']
+                return
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+
+        with open(self.path, 'r', encoding='utf-8') as j:
+            features = json.load(j)['features']
+        self.names = [feature['properties']['name'] for feature in features]
+        self.sns = [int(feature['properties']['COUNTYSN']) for feature in features]
+        geometries = [shape(feature['geometry']) for feature in features]
+        # level 0 為原始精度
+        self.levels = {0: [geometry.wkb for geometry in geometries]}
+        for zoom in self.zoom_levels:
+            tolerance = pixel_degrees(zoom)
+            self.levels[zoom] = [geometry.simplify(tolerance, preserve_topology=True).wkb
+                                 for geometry in geometries]
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'stamp': stamp, 'names': self.names, 'sns': self.sns, 'levels': self.levels}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def level_for_zoom(self, zoom):
+        # 選擇誤差不超過一個像素的最粗略層級，比所有層級都更放大時使用原始精度
+        for candidate in self.zoom_levels:
+            if candidate >= zoom:
+                return candidate
+        return 0
+
+    @traced('dataframe.frame')
+    def frame(self, zoom=None):
+        self._load()
+        level = 0 if zoom is None else self.level_for_zoom(zoom)
+        if level not in self._frames:
+            geometries = [wkb.loads(data) for data in self.levels[level]]
+            self._frames[level] = gpd.GeoDataFrame(
+                {'name': self.names, 'CountySN': self.sns}, geometry=geometries, crs='EPSG:4326')
+        return self._frames[level]
+
+    @traced('geometry.geojson')
+    def geojson(self, zoom=None):
+        level = 0 if zoom is None else self.level_for_zoom(zoom)
+        if level not in self._geojson:
+            self._geojson[level] = json.loads(self.frame(zoom)[['name', 'geometry']].to_json())
+        return self._geojson[level]
+
+    @traced('dataframe.join')
+    def join(self, rows, zoom=None):
+        # rows: (City/County, Count, ...)，只把判決數對到已快取的縣市界線上
+        counts = {row[0]: row[1] for row in rows}
+        frame = self.frame(zoom)
+        joined = frame[['name', 'geometry']].copy()
+        joined['City/County'] = joined['name']
+        joined['Count'] = [counts.get(name, 0) for name in self.names]
+        return joined
+
+
+_service = None
+
+
+def geometry_service():
+    global _service
+    if _service is None:
+        _service = GeometryService()
+    return _service
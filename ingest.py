@@ -0,0 +1,207 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+
+from database import DATABASE, create_connection
+
+BATCH_SIZE = 10000
+TRIPLE_FIELDS = ('head entity type', 'head entity', 'relation', 'tail entity', 'tail entity type')
+JUDGMENT_FIELDS = ('JID', 'region', 'year', 'category', 'number')
+FIELDS = TRIPLE_FIELDS + JUDGMENT_FIELDS
+
+# 例：臺灣臺中地方法院 109 年度金訴字第 88 號刑事判決 -> ('臺中', '109', '金訴', '88')；
+# 高等法院分院以分院所在地為 region，例：臺灣高等法院 臺南分院 ... -> '臺南'
+JID_PATTERN = re.compile(r'^(?:臺灣)?(?:高等法院 )?(\S+?)(?:地方法院|分院)? (\d+) 年度(\S+?)字第 (\d+) 號')
+WHOLE_REGIONS = ('臺灣高等法院', '福建金門地方法院', '福建連江地方法院')
+
+
+def parse_jid(jid):
+    # 資料缺少 region / year / category / number 時由 JID 推得，格式不符回傳 None
+    match = JID_PATTERN.match(jid)
+    if match is None:
+        return None
+    region, year, category, number = match.groups()
+    if not jid.split()[1].endswith('分院'):
+        for whole in WHOLE_REGIONS:
+            if jid.startswith(whole):
+                region = whole
+    return region, year, category, number
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+
+
+def read_csv(path):
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        for line_no, record in enumerate(csv.DictReader(f), 2):
+            yield line_no, record
+
+
+READERS = {'.jsonl': read_jsonl, '.json': read_jsonl, '.ndjson': read_jsonl, '.csv': read_csv}
+
+
+def read_records(path, fmt=None):
+    reader = READERS[fmt or os.path.splitext(path)[1].lower()]
+    for line_no, record in reader(path):
+        yield f'{path}:{line_no}', record
+
+
+def validate(records, stats, errors=sys.stderr):
+    # 欄位去除前後空白；三元組欄位與 JID 不可為空，判決欄位缺漏時由 JID 補齊
+    for where, record in records:
+        stats['read'] += 1
+        if not isinstance(record, dict):
+            reason = record if isinstance(record, Exception) else 'not an object'
+        else:
+            row = [str(record.get(field) or '').strip() for field in FIELDS]
+            missing = [field for field, value in zip(FIELDS[:6], row) if not value]
+            parsed = parse_jid(row[5]) if row[5] else None
+            if not missing and not all(row[6:]):
+                if parsed is None:
+                    missing = [field for field, value in zip(FIELDS[6:], row[6:]) if not value]
+                else:
+                    row[6:] = [value or derived for value, derived in zip(row[6:], parsed)]
+            if not missing:
+                yield tuple(row)
+                continue
+            reason = 'missing ' + ', '.join(missing)
+        stats['rejected'] += 1
+        print(f'{where}: {reason}', file=errors)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Ingester:
+    # 實體、關係與判決的字典預先載入記憶體，新值在交易內配發 id 後以 executemany 一次寫入；
+    # judgment_stats 由既有的 trigger 更新；triple_fts 逐列 trigger 太慢，批次內先移除 trigger，
+    # 寫入後以一句 INSERT ... SELECT 補上索引再重建 trigger，全部在同一個交易內。假設同時只有一個寫入者
+    def __init__(self, conn, stats):
+        self.conn = conn
+        self.stats = stats
+        self.entities = {(name, kind): id for id, name, kind in conn.execute('SELECT id, name, type FROM entity')}
+        self.relations = {name: id for id, name in conn.execute('SELECT id, name FROM relation')}
+        self.judgments = {jid: id for id, jid in conn.execute('SELECT id, jid FROM judgment')}
+        self.existing = set(self.judgments.values())
+        self.seen = set()
+        self.fts_trigger = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'triple_fts_insert'").fetchone()[0]
+
+    def encode(self, table, cache, key, values, new_rows):
+        id = cache.get(key)
+        if id is None:
+            id = cache[key] = self.next_id[table]
+            self.next_id[table] += 1
+            new_rows.append((id,) + values)
+        return id
+
+    def load_existing(self, judgment_ids):
+        # 既有判決只在第一次遇到時讀入其三元組，供去重使用
+        judgment_ids = [id for id in judgment_ids if id in self.existing]
+        for id in judgment_ids:
+            self.seen.update(self.conn.execute(
+                'SELECT judgment_id, head_id, relation_id, tail_id FROM triple WHERE judgment_id = ?', (id,)))
+            self.existing.discard(id)
+
+    def write(self, batch):
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.next_id = {table: conn.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+                            for table in ('entity', 'relation', 'judgment', 'triple')}
+            new_entities, new_relations, new_judgments = [], [], []
+            triples = []
+            for head_type, head, relation, tail, tail_type, jid, region, year, category, number in batch:
+                triples.append((
+                    self.encode('judgment', self.judgments, jid, (jid, region, year, category, number),
+                                new_judgments),
+                    self.encode('entity', self.entities, (head, head_type), (head, head_type), new_entities),
+                    self.encode('relation', self.relations, relation, (relation,), new_relations),
+                    self.encode('entity', self.entities, (tail, tail_type), (tail, tail_type), new_entities),
+                ))
+            self.load_existing({triple[0] for triple in triples})
+            # 以整數 key 去重：同一份輸入內重複的與資料庫既有的三元組都在這裡略過
+            fresh = []
+            for triple in triples:
+                if triple in self.seen:
+                    self.stats['duplicates'] += 1
+                else:
+                    self.seen.add(triple)
+                    fresh.append(triple)
+
+            conn.executemany('INSERT INTO entity (id, name, type) VALUES (?, ?, ?)', new_entities)
+            conn.executemany('INSERT INTO relation (id, name) VALUES (?, ?)', new_relations)
+            conn.executemany('INSERT INTO judgment (id, jid, region, year, category, number) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', new_judgments)
+            conn.execute('DROP TRIGGER triple_fts_insert')
+            conn.executemany('INSERT INTO triple (judgment_id, head_id, relation_id, tail_id) '
+                             'VALUES (?, ?, ?, ?)', fresh)
+            conn.execute('INSERT INTO triple_fts (rowid, head_type, head, relation, tail, tail_type) '
+                         'SELECT id, head_type, head, relation, tail, tail_type FROM triple_text WHERE id >= ?',
+                         (self.next_id['triple'],))
+            conn.execute(self.fts_trigger)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.stats['entities'] += len(new_entities)
+        self.stats['relations'] += len(new_relations)
+        self.stats['judgments'] += len(new_judgments)
+        self.stats['triples'] += len(fresh)
+
+
+def ingest(paths, db=DATABASE, fmt=None, batch_size=BATCH_SIZE, errors=sys.stderr):
+    stats = dict.fromkeys(('read', 'rejected', 'duplicates', 'triples', 'judgments', 'entities', 'relations'), 0)
+    conn = create_connection(db)
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA cache_size = -65536')
+        conn.isolation_level = None
+        records = itertools.chain.from_iterable(read_records(path, fmt) for path in paths)
+        rows = validate(records, stats, errors)
+        ingester = Ingester(conn, stats)
+        for batch in batched(rows, batch_size):
+            ingester.write(batch)
+            print(f'{stats["read"]} read, {stats["triples"]} inserted', file=errors)
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m CAMLKG ingest',
+                                     description='Load judgment triples from JSONL or CSV files into the database.')
+    parser.add_argument('paths', nargs='+', metavar='FILE',
+                        help='JSONL or CSV with the caml columns; region/year/category/number may be omitted')
+    parser.add_argument('--db', default=DATABASE)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='default: by file extension')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    stats = ingest(args.paths, args.db, args.format and '.' + args.format, args.batch_size)
+    print(', '.join(f'{value} {key}' for key, value in stats.items()))
+    return 1 if stats['rejected'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
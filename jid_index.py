@@ -0,0 +1,93 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from ingest import parse_jid
+from tracing import traced
+
+FIELDS = ('region', 'year', 'category', 'number')
+# 年度與號數以開頭比對 (輸入 11 找到 110 年度或第 11x 號)，法院與字別以子字串比對
+PREFIX_FIELDS = ('year', 'number')
+MASK_CACHE = 64
+
+
+def sort_number(value):
+    return (0, int(value), value) if value.isdigit() else (1, 0, value)
+
+
+class JidIndex:
+    # 所有判決字號依 (法院, 年度, 字別, 號) 排序；四個欄位各自字典編碼成整數陣列，
+    # 輸入的每個詞只需比對各欄位的相異值 (數十到數千個)，再以 numpy 一次篩出符合的判決
+    def __init__(self, jids, values, codes):
+        self.jids = jids
+        self.values = values
+        self.codes = codes
+        self._positions = {jid: i for i, jid in enumerate(jids)}
+        self._jid_array = None
+        self._masks = OrderedDict()
+
+    @classmethod
+    @traced('index.jid_build')
+    def build(cls, conn):
+        records = []
+        for jid, *fields in conn.execute('SELECT jid, region, year, category, number FROM judgment'):
+            if None in fields:
+                # 欄位缺漏時由 JID 推得，格式不符的部分以空字串代替
+                parsed = parse_jid(jid) or ('', '', '', '')
+                fields = [value if value is not None else default for value, default in zip(fields, parsed)]
+            records.append((jid, *fields))
+        records.sort(key=lambda r: (r[1], sort_number(r[2]), r[3], sort_number(r[4]), r[0]))
+
+        jids = [r[0] for r in records]
+        values, codes = {}, {}
+        for i, field in enumerate(FIELDS, 1):
+            distinct, inverse = np.unique(np.array([r[i] for r in records], dtype=str), return_inverse=True)
+            values[field] = distinct.tolist()
+            codes[field] = inverse.astype(np.int32).reshape(-1)
+        return cls(jids, values, codes)
+
+    def __len__(self):
+        return len(self.jids)
+
+    def __contains__(self, jid):
+        return jid in self._positions
+
+    def position(self, jid):
+        return self._positions.get(jid)
+
+    def fields(self, position):
+        return tuple(self.values[field][self.codes[field][position]] for field in FIELDS)
+
+    def token_mask(self, token):
+        # 各詞的結果保留最近 MASK_CACHE 個，輸入時每按一鍵只需計算正在輸入的那個詞
+        mask = self._masks.get(token)
+        if mask is not None:
+            self._masks.move_to_end(token)
+            return mask
+        mask = np.zeros(len(self.jids), dtype=bool)
+        for field in FIELDS:
+            if field in PREFIX_FIELDS:
+                hits = [i for i, value in enumerate(self.values[field]) if value.startswith(token)]
+            else:
+                hits = [i for i, value in enumerate(self.values[field]) if token in value]
+            if hits:
+                mask |= np.isin(self.codes[field], hits)
+        if not mask.any():
+            # 不屬於任何欄位的詞 (例如 臺灣、地方法院、刑事判決) 直接比對整個字號
+            if self._jid_array is None:
+                self._jid_array = np.array(self.jids, dtype=str)
+            mask = np.char.find(self._jid_array, token) >= 0
+        self._masks[token] = mask
+        if len(self._masks) > MASK_CACHE:
+            self._masks.popitem(last=False)
+        return mask
+
+    def search(self, text):
+        # 以空白分隔的每個詞都必須符合，回傳依排序的位置
+        tokens = text.split()
+        if not tokens:
+            return np.arange(len(self.jids))
+        mask = self.token_mask(tokens[0])
+        for token in tokens[1:]:
+            mask = mask & self.token_mask(token)
+        return np.flatnonzero(mask)
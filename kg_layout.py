@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from tracing import traced
+
+LAYOUT_DIR = './layouts'
+LAYOUT_VERSION = 1
+
+# 知識圖譜節點依實體類型上色
+ENTITY_COLORS = {
+    'Person': '#E377C2',
+    'Law': '#1F77B4',
+    'Account': '#2CA02C',
+    'Money': '#FF7F0E',
+    'Cryptocurrency': '#9467BD',
+    'Organization': '#17BECF',
+}
+
+
+class KnowledgeGraph:
+    # nodes 以 (名稱, 類型) 區分，edges 為 node index 的 (head, tail) 陣列
+    def __init__(self, rows):
+        self.nodes = []
+        self.types = []
+        self.relations = []
+        index = {}
+        edges = []
+        for head_type, head, relation, tail, tail_type in rows:
+            ends = []
+            for name, kind in ((head, head_type), (tail, tail_type)):
+                key = (name, kind)
+                if key not in index:
+                    index[key] = len(self.nodes)
+                    self.nodes.append(name)
+                    self.types.append(kind)
+                ends.append(index[key])
+            edges.append(ends)
+            self.relations.append(relation)
+        self.edges = np.array(edges, dtype=np.int32).reshape(-1, 2)
+        self.pos = None
+
+    def digest(self):
+        h = hashlib.sha1()
+        h.update(str(LAYOUT_VERSION).encode())
+        for name, kind in zip(self.nodes, self.types):
+            h.update(f'{kind}\x1f{name}\x1e'.encode('utf-8'))
+        h.update(self.edges.tobytes())
+        return h.hexdigest()
+
+
+@traced('kg.spring_layout')
+def spring_layout(n, edges, iterations=100, seed=0):
+    # Fruchterman-Reingold，節點數量小 (單一判決) 時直接用 dense 矩陣計算
+    if n == 0:
+        return np.zeros((0, 2))
+    if n == 1:
+        return np.zeros((1, 2))
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    adj = np.zeros((n, n))
+    if len(edges):
+        adj[edges[:, 0], edges[:, 1]] = 1
+        adj[edges[:, 1], edges[:, 0]] = 1
+    np.fill_diagonal(adj, 0)
+    k = np.sqrt(1.0 / n)
+    t = 0.1
+    dt = t / (iterations + 1)
+    for _ in range(iterations):
+        delta = pos[:, None, :] - pos[None, :, :]
+        distance = np.linalg.norm(delta, axis=-1)
+        np.clip(distance, 0.01, None, out=distance)
+        force = k * k / distance ** 2 - adj * distance / k
+        displacement = np.einsum('ijk,ij->ik', delta, force)
+        length = np.linalg.norm(displacement, axis=-1)
+        length = np.where(length < 0.01, 0.1, length)
+        pos += displacement * (t / length)[:, None]
+        t -= dt
+    pos -= pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    if scale > 0:
+        pos /= scale
+    return pos
+
+
+def layout_path(jid, layout_dir=LAYOUT_DIR):
+    return os.path.join(layout_dir, jid + '.json')
+
+
+def load_layout(jid, graph, layout_dir=LAYOUT_DIR):
+    path = layout_path(jid, layout_dir)
+    digest = graph.digest()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('key') == digest:
+            graph.pos = np.array(cached['pos'], dtype=float).reshape(-1, 2)
+            return graph
+    except (OSError, ValueError, KeyError):
+        pass
+
+    graph.pos = spring_layout(len(graph.nodes), graph.edges)
+    os.makedirs(layout_dir, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'key': digest, 'pos': graph.pos.round(5).tolist()}, f)
+    os.replace(tmp_path, path)
+    return graph
+
+
+def kg_layout(jid, rows, layout_dir=LAYOUT_DIR):
+    return load_layout(jid, KnowledgeGraph(rows), layout_dir)
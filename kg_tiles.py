@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyqtgraph as pg
+from PIL import Image
+from PyQt6.QtCore import QRectF
+
+from tracing import traced
+
+IMAGES_DIR = './images'
+TILES_DIR = './tiles'
+TILE_SIZE = 256
+PYRAMID_VERSION = 1
+
+
+def pyramid_dir(jid, tiles_dir=TILES_DIR):
+    return os.path.join(tiles_dir, jid)
+
+
+def source_stamp(png_path):
+    stat = os.stat(png_path)
+    return [PYRAMID_VERSION, stat.st_size, stat.st_mtime_ns]
+
+
+def is_current(png_path, out_dir):
+    try:
+        with open(os.path.join(out_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)['stamp'] == source_stamp(png_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def to_tiles(array, tile=TILE_SIZE):
+    # (H, W, 4) -> (rows, cols, tile, tile, 4)，每個 tile 在檔案中是連續的一塊
+    height, width = array.shape[:2]
+    rows, cols = math.ceil(height / tile), math.ceil(width / tile)
+    padded = np.zeros((rows * tile, cols * tile, 4), dtype=np.uint8)
+    padded[:height, :width] = array
+    return np.ascontiguousarray(padded.reshape(rows, tile, cols, tile, 4).transpose(0, 2, 1, 3, 4))
+
+
+def build_pyramid(png_path, out_dir, tile=TILE_SIZE):
+    # 逐層縮小一半直到整張圖可放進一個 tile，每層以 uint8 存成可 memory-map 的 .npy。
+    # 先寫到暫存目錄再整個換上：已開啟的 Pyramid 可能正 memory-map 舊的檔案，不能直接覆寫
+    if is_current(png_path, out_dir):
+        return out_dir
+    tmp_dir = f'{out_dir}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        image = Image.open(png_path).convert('RGBA')
+        levels = []
+        level = 0
+        while True:
+            array = np.asarray(image, dtype=np.uint8)
+            np.save(os.path.join(tmp_dir, f'L{level}.npy'), to_tiles(array, tile))
+            levels.append([image.width, image.height])
+            if max(image.width, image.height) <= tile:
+                break
+            image = image.resize((max(1, image.width // 2), max(1, image.height // 2)), Image.Resampling.BOX)
+            level += 1
+        meta = {'stamp': source_stamp(png_path), 'tile': tile, 'levels': levels}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        replace_dir(tmp_dir, out_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return out_dir
+
+
+def replace_dir(src, dst):
+    # 目錄不能以 os.replace 覆蓋非空的目錄：舊目錄先移開再換上新的，移開的檔案在被 unmap 前仍可讀取。
+    # 其他工作同時換上同一個目錄時以先完成的為準 (內容相同)
+    old_dir = f'{src}.old'
+    try:
+        os.rename(dst, old_dir)
+    except OSError:
+        # 不存在，或 (Windows) 仍有檔案開啟而無法移動：後者保留舊的目錄，下次使用時再重建
+        old_dir = None
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(os.path.join(dst, 'meta.json')):
+            raise
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class Pyramid:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.tile = meta['tile']
+        self.levels = meta['levels']
+        self.width, self.height = self.levels[0]
+        self._arrays = {}
+
+    def level(self, level):
+        # 只 memory-map，實際讀入的只有畫面上用到的 tile
+        if level not in self._arrays:
+            self._arrays[level] = np.load(os.path.join(self.path, f'L{level}.npy'), mmap_mode='r')
+        return self._arrays[level]
+
+    def tileData(self, level, row, col):
+        width, height = self.levels[level]
+        h = min(self.tile, height - row * self.tile)
+        w = min(self.tile, width - col * self.tile)
+        return np.array(self.level(level)[row, col, :h, :w])
+
+
+@traced('kg.pyramid')
+def load_pyramid(jid, images_dir=IMAGES_DIR, tiles_dir=TILES_DIR):
+    png_path = os.path.join(images_dir, jid + '.png')
+    out_dir = pyramid_dir(jid, tiles_dir)
+    if not os.path.exists(png_path):
+        if os.path.exists(os.path.join(out_dir, 'meta.json')):
+            return Pyramid(out_dir)
+        return None
+    return Pyramid(build_pyramid(png_path, out_dir))
+
+
+class TiledImage:
+    # 依 PlotWidget 目前的縮放選擇層級，只建立可見範圍內的 tile；座標一律以原圖像素為單位
+    MAX_ITEMS = 64
+
+    def __init__(self, plot_widget, pyramid):
+        self.plot = plot_widget
+        self.pyramid = pyramid
+        self.items = {}
+        self.view_box = plot_widget.getViewBox()
+        self.view_box.sigRangeChanged.connect(self.update)
+        self.plot.setRange(xRange=(0, pyramid.width), yRange=(0, pyramid.height), padding=0)
+        self.update()
+
+    def chooseLevel(self):
+        pixel_width, pixel_height = self.view_box.viewPixelSize()
+        scale = max(pixel_width, pixel_height, 1e-9)
+        level = int(math.floor(math.log2(scale))) if scale > 1 else 0
+        return min(level, len(self.pyramid.levels) - 1)
+
+    def visibleTiles(self, level):
+        (x0, x1), (y0, y1) = self.view_box.viewRange()
+        span = self.pyramid.tile * 2 ** level
+        width, height = self.pyramid.levels[level]
+        cols = math.ceil(width / self.pyramid.tile)
+        rows = math.ceil(height / self.pyramid.tile)
+        col_range = range(max(0, int(x0 // span)), min(cols, int(x1 // span) + 1))
+        row_range = range(max(0, int(y0 // span)), min(rows, int(y1 // span) + 1))
+        return [(level, row, col) for row in row_range for col in col_range]
+
+    @traced('widget.tiles')
+    def update(self, *args):
+        level = self.chooseLevel()
+        visible = self.visibleTiles(level)
+        for key in list(self.items):
+            if key not in visible:
+                self.plot.removeItem(self.items.pop(key))
+        for key in visible[:self.MAX_ITEMS]:
+            if key in self.items:
+                continue
+            level, row, col = key
+            data = self.pyramid.tileData(level, row, col)
+            scale = 2 ** level
+            item = pg.ImageItem(data, axisOrder='row-major')
+            item.setRect(QRectF(col * self.pyramid.tile * scale, row * self.pyramid.tile * scale,
+                                data.shape[1] * scale, data.shape[0] * scale))
+            self.plot.addItem(item)
+            self.items[key] = item
+
+    def close(self):
+        self.view_box.sigRangeChanged.disconnect(self.update)
+        for item in self.items.values():
+            self.plot.removeItem(item)
+        self.items.clear()
+
+
+def preprocess(images_dir=IMAGES_DIR, tiles_dir=TILES_DIR, workers=None):
+    png_paths = []
+    out_dirs = []
+    for name in sorted(os.listdir(images_dir)):
+        if name.lower().endswith('.png'):
+            png_paths.append(os.path.join(images_dir, name))
+            out_dirs.append(pyramid_dir(name[:-4], tiles_dir))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for out_dir in executor.map(build_pyramid, png_paths, out_dirs):
+            print(out_dir)
+    return len(png_paths)
+
+
+if __name__ == '__main__':
+    # python kg_tiles.py [images_dir] [tiles_dir]
+    preprocess(*sys.argv[1:3])
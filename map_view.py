@@ -0,0 +1,27 @@
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+
+from choropleth import choropleth_data, choropleth_map, update_script
+
+
+class ChoroplethView(QWebEngineView):
+    # 地圖與縣市界線只載入一次，切換年份時只送出各縣市的判決數與色階
+    def __init__(self, geojson, location=(23.73, 120.96), zoom=7, parent=None):
+        super(ChoroplethView, self).__init__(parent)
+        m = choropleth_map(geojson, location, zoom)
+        self.ready = False
+        self.pending = None
+        self.loadFinished.connect(self.onLoadFinished)
+        self.setHtml(m.get_root().render())
+
+    def onLoadFinished(self, ok):
+        self.ready = ok
+        if ok and self.pending is not None:
+            self.page().runJavaScript(self.pending)
+            self.pending = None
+
+    def setCounts(self, rows, title):
+        script = update_script(choropleth_data(rows, title))
+        if self.ready:
+            self.page().runJavaScript(script)
+        else:
+            self.pending = script
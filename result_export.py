@@ -0,0 +1,142 @@
+import csv
+import os
+import threading
+
+from tracing import traced
+
+CHUNK_ROWS = 5000
+# Excel 每張工作表最多 1048576 列 (含標題列)，超過時接續寫到下一張
+XLSX_MAX_ROWS = 1048576
+FORMATS = ('csv', 'xlsx', 'parquet')
+
+
+def format_for(path):
+    fmt = os.path.splitext(path)[1].lower().lstrip('.')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported export format: {path} (expected .csv, .xlsx or .parquet)')
+    return fmt
+
+
+class CsvWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class XlsxWriter:
+    # openpyxl 的 write-only 模式：append 的列直接寫到暫存檔，不保留整張工作表
+    def __init__(self, path, columns):
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+        self.path = path
+        self.columns = columns
+        self.illegal = ILLEGAL_CHARACTERS_RE
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.rows = XLSX_MAX_ROWS
+
+    def clean(self, value):
+        # 判決文字偶有控制字元，openpyxl 會拒絕寫入
+        return self.illegal.sub('', value) if isinstance(value, str) else value
+
+    def write(self, rows):
+        for row in rows:
+            if self.rows >= XLSX_MAX_ROWS:
+                self.sheet = self.workbook.create_sheet(f'Sheet{len(self.workbook.sheetnames) + 1}')
+                self.sheet.append(self.columns)
+                self.rows = 1
+            self.sheet.append([self.clean(value) for value in row])
+            self.rows += 1
+
+    def close(self):
+        if self.sheet is None:
+            self.workbook.create_sheet('Sheet1').append(self.columns)
+        self.workbook.save(self.path)
+
+    def abort(self):
+        self.workbook.close()
+
+
+class ParquetWriter:
+    # 每個 chunk 寫成一個 row group；欄位型別由第一個 chunk 推得，全為 NULL 的欄位視為字串
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError('Parquet export requires pyarrow (pip install pyarrow)') from e
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.columns = columns
+        self.schema = None
+        self.writer = None
+
+    def write(self, rows):
+        pa = self.pa
+        values = list(zip(*rows))
+        if self.writer is None:
+            arrays = [pa.array(column) for column in values]
+            arrays = [array.cast(pa.string()) if pa.types.is_null(array.type) else array for array in arrays]
+            self.schema = pa.schema([(name, array.type) for name, array in zip(self.columns, arrays)])
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        else:
+            arrays = [pa.array(column, type=field.type) for column, field in zip(values, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            self.schema = self.pa.schema([(name, self.pa.string()) for name in self.columns])
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.close()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {'csv': CsvWriter, 'xlsx': XlsxWriter, 'parquet': ParquetWriter}
+
+
+@traced('export.query')
+def export_query(conn, sql, params, path, total=None, chunk_rows=CHUNK_ROWS, progress=None):
+    # 以 fetchmany 分批讀出查詢結果並寫出，記憶體中只有一個 chunk；_key 排序鍵不輸出
+    # progress(percent) 在每個 chunk 後呼叫，total 為 None 時不回報
+    writer_class = WRITERS[format_for(path)]
+    cur = conn.execute(sql, tuple(params))
+    names = [d[0] for d in cur.description]
+    keep = [i for i, name in enumerate(names) if name != '_key']
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    writer = writer_class(tmp_path, [names[i] for i in keep])
+    count = 0
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if len(keep) < len(names):
+                rows = [tuple(row[i] for i in keep) for row in rows]
+            writer.write(rows)
+            count += len(rows)
+            if progress is not None and total:
+                progress(min(100, count * 100 // total))
+        writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        writer.abort()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        cur.close()
+    return count
@@ -0,0 +1,296 @@
+import os
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from entity_graph import database_stamp
+from tracing import traced
+
+SIMILARITY_PATH = './cache/similarity.npz'
+SIMILARITY_VERSION = 1
+TOP_K = 20
+BATCH_ROWS = 1024
+# 增量加入的判決沿用既有的 idf，新增量超過上次完整建立時的比例就整個重算
+REBUILD_RATIO = 0.25
+
+# 特徵以 int64 編碼：(relation, tail entity) 與 (head type, relation, tail type) 兩類
+RELATION_TAIL = np.int64(1) << 62
+TYPE_PATTERN = np.int64(1) << 61
+FIELD_BITS = 20
+FIELD_MASK = (1 << FIELD_BITS) - 1
+
+
+def feature_keys(relation_ids, tail_ids, head_types, tail_types):
+    relation_ids = relation_ids.astype(np.int64)
+    relation_tail = RELATION_TAIL | (relation_ids << 31) | tail_ids.astype(np.int64)
+    type_pattern = (TYPE_PATTERN | (head_types.astype(np.int64) << (2 * FIELD_BITS))
+                    | (relation_ids << FIELD_BITS) | tail_types.astype(np.int64))
+    return np.concatenate([relation_tail, type_pattern])
+
+
+def decode_key(key):
+    key = int(key)
+    if key & int(RELATION_TAIL):
+        return 'relation_tail', (key >> 31) & ((1 << 31) - 1), key & ((1 << 31) - 1)
+    return ('type_pattern', (key >> (2 * FIELD_BITS)) & FIELD_MASK, (key >> FIELD_BITS) & FIELD_MASK,
+            key & FIELD_MASK)
+
+
+def read_triples(conn, judgment_ids=None):
+    # 回傳 (judgment_id, head_id, relation_id, tail_id) 的 int64 陣列
+    sql = 'SELECT judgment_id, head_id, relation_id, tail_id FROM triple'
+    params = ()
+    if judgment_ids is not None:
+        sql += f" WHERE judgment_id IN ({', '.join('?' * len(judgment_ids))})"
+        params = [int(id) for id in judgment_ids]
+    return np.array(conn.execute(sql, params).fetchall(), dtype=np.int64).reshape(-1, 4)
+
+
+def judgment_counts(conn):
+    rows = np.array(conn.execute(
+        'SELECT j.id, COUNT(t.id) FROM judgment j LEFT JOIN triple t ON t.judgment_id = j.id '
+        'GROUP BY j.id ORDER BY j.id').fetchall(), dtype=np.int64).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def top_k(queries, corpus, k, offset=0):
+    # 以批次的稀疏矩陣乘法計算 cosine，每列只保留前 k 名；offset 為 queries 第一列在 corpus 中的位置，用來排除自己
+    n = queries.shape[0]
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    corpus_t = corpus.T.tocsc()
+    for start in range(0, n, BATCH_ROWS):
+        product = (queries[start:start + BATCH_ROWS] @ corpus_t).tocsr()
+        for i in range(product.shape[0]):
+            row = start + i
+            columns = product.indices[product.indptr[i]:product.indptr[i + 1]]
+            values = product.data[product.indptr[i]:product.indptr[i + 1]]
+            keep = columns != offset + row
+            columns, values = columns[keep], values[keep]
+            if len(values) > k:
+                best = np.argpartition(-values, k)[:k]
+                columns, values = columns[best], values[best]
+            order = np.lexsort((columns, -values))
+            neighbors[row, :len(order)] = columns[order]
+            scores[row, :len(order)] = values[order]
+    return neighbors, scores
+
+
+def merge_top_k(neighbors, scores, candidates, candidate_scores, k):
+    # 將新判決的分數併入既有的前 k 名
+    neighbors = np.concatenate([neighbors, candidates])
+    scores = np.concatenate([scores, candidate_scores])
+    valid = neighbors >= 0
+    neighbors, scores = neighbors[valid], scores[valid]
+    order = np.lexsort((neighbors, -scores))[:k]
+    merged = np.full(k, -1, dtype=np.int32)
+    merged_scores = np.zeros(k, dtype=np.float32)
+    merged[:len(order)] = neighbors[order]
+    merged_scores[:len(order)] = scores[order]
+    return merged, merged_scores
+
+
+class SimilarityIndex:
+    # 每個判決是其三元組特徵的 TF-IDF 向量 (列已正規化，內積即 cosine)，並預先算好每個判決的前 k 名
+    def __init__(self, judgment_ids, counts, vocabulary, idf, type_names, matrix, neighbors, scores,
+                 stamp, built_size):
+        self.judgment_ids = judgment_ids
+        self.counts = counts
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.type_names = [str(name) for name in type_names]
+        self.matrix = matrix
+        self.neighbors = neighbors
+        self.scores = scores
+        self.stamp = stamp
+        self.built_size = built_size
+        self._positions = {id: i for i, id in enumerate(judgment_ids.tolist())}
+
+    @staticmethod
+    def entity_types(conn, type_names):
+        # entity id -> 類型編號；type_names 只會往後加，既有的編號不變
+        codes = {name: i for i, name in enumerate(type_names)}
+        rows = conn.execute('SELECT id, type FROM entity').fetchall()
+        lookup = np.zeros(max((id for id, _ in rows), default=0) + 1, dtype=np.int64)
+        for id, name in rows:
+            if name not in codes:
+                codes[name] = len(type_names)
+                type_names.append(name)
+            lookup[id] = codes[name]
+        return lookup
+
+    @staticmethod
+    def features(triples, positions, types):
+        keys = feature_keys(triples[:, 2], triples[:, 3], types[triples[:, 1]], types[triples[:, 3]])
+        return np.concatenate([positions, positions]), keys
+
+    @classmethod
+    @traced('index.similarity_build')
+    def build(cls, conn, k=TOP_K):
+        stamp = database_stamp(conn)
+        judgment_ids, counts = judgment_counts(conn)
+        type_names = []
+        types = cls.entity_types(conn, type_names)
+        triples = read_triples(conn)
+        rows, keys = cls.features(triples, np.searchsorted(judgment_ids, triples[:, 0]), types)
+        vocabulary, columns = np.unique(keys, return_inverse=True)
+        n = len(judgment_ids)
+        tf = sparse.csr_matrix((np.ones(len(rows)), (rows, columns.ravel())), shape=(n, len(vocabulary)))
+        df = np.bincount(tf.indices, minlength=len(vocabulary))
+        idf = np.log((1 + n) / (1 + df)) + 1
+        matrix = normalize_rows(tf.log1p() @ sparse.diags(idf)).tocsr().astype(np.float32)
+        neighbors, scores = top_k(matrix, matrix, k)
+        return cls(judgment_ids, counts, vocabulary, idf, type_names, matrix, neighbors, scores, stamp, n)
+
+    def extend(self, conn, judgment_ids, counts):
+        # 只為新增的判決計算向量與前 k 名，並把它們併入既有判決的前 k 名
+        k = self.neighbors.shape[1]
+        old = len(self.judgment_ids)
+        types = self.entity_types(conn, self.type_names)
+        triples = read_triples(conn, judgment_ids)
+        rows, keys = self.features(triples, np.searchsorted(judgment_ids, triples[:, 0]), types)
+
+        sorter = np.argsort(self.vocabulary)
+        found = np.searchsorted(self.vocabulary, keys, sorter=sorter)
+        found = np.minimum(found, len(self.vocabulary) - 1)
+        columns = sorter[found]
+        unseen = self.vocabulary[columns] != keys
+        new_keys, new_columns = np.unique(keys[unseen], return_inverse=True)
+        columns[unseen] = len(self.vocabulary) + new_columns.ravel()
+        self.vocabulary = np.concatenate([self.vocabulary, new_keys])
+        # 沒見過的特徵視為只出現在一個判決
+        self.idf = np.concatenate([self.idf, np.full(len(new_keys), np.log((1 + self.built_size) / 2) + 1)])
+
+        width = len(self.vocabulary)
+        tf = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(judgment_ids), width))
+        added = normalize_rows(tf.log1p() @ sparse.diags(self.idf)).tocsr().astype(np.float32)
+        matrix = self.matrix.copy()
+        matrix.resize((old, width))
+        self.matrix = sparse.vstack([matrix, added]).tocsr()
+
+        neighbors, scores = top_k(added, self.matrix, k, offset=old)
+        cross = (matrix @ added.T).tocsr()
+        old_neighbors = self.neighbors.copy()
+        old_scores = self.scores.copy()
+        for row in np.flatnonzero(np.diff(cross.indptr)):
+            span = slice(cross.indptr[row], cross.indptr[row + 1])
+            old_neighbors[row], old_scores[row] = merge_top_k(
+                old_neighbors[row], old_scores[row], cross.indices[span] + old, cross.data[span], k)
+        self.neighbors = np.concatenate([old_neighbors, neighbors])
+        self.scores = np.concatenate([old_scores, scores])
+        self.judgment_ids = np.concatenate([self.judgment_ids, judgment_ids])
+        self.counts = np.concatenate([self.counts, counts])
+        self._positions = {id: i for i, id in enumerate(self.judgment_ids.tolist())}
+
+    @traced('index.similarity_refresh')
+    def refresh(self, conn):
+        # 回傳更新後的索引：只有新增判決時增量更新，判決被刪除或內容改變、或新增太多時重建
+        stamp = database_stamp(conn)
+        if np.array_equal(stamp, self.stamp):
+            return self
+        judgment_ids, counts = judgment_counts(conn)
+        known = np.isin(judgment_ids, self.judgment_ids)
+        previous = dict(zip(self.judgment_ids.tolist(), self.counts.tolist()))
+        unchanged = (known.sum() == len(self.judgment_ids)
+                     and all(previous[id] == count for id, count in
+                             zip(judgment_ids[known].tolist(), counts[known].tolist())))
+        new = ~known
+        if not unchanged or len(self.judgment_ids) + new.sum() > self.built_size * (1 + REBUILD_RATIO):
+            return self.build(conn, self.neighbors.shape[1])
+        if new.any():
+            self.extend(conn, judgment_ids[new], counts[new])
+        self.stamp = stamp
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != SIMILARITY_VERSION:
+                raise ValueError(f'{path}: similarity index version {int(data["version"])}')
+            matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+            return cls(data['judgment_ids'], data['counts'], data['vocabulary'], data['idf'], data['type_names'],
+                       matrix, data['neighbors'], data['scores'], data['stamp'], int(data['built_size']))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp_path, version=SIMILARITY_VERSION, judgment_ids=self.judgment_ids, counts=self.counts, vocabulary=self.vocabulary,
+                 idf=self.idf, type_names=np.array(self.type_names, dtype=str), data=self.matrix.data,
+                 indices=self.matrix.indices, indptr=self.matrix.indptr, shape=np.array(self.matrix.shape),
+                 neighbors=self.neighbors, scores=self.scores, stamp=self.stamp, built_size=self.built_size)
+        os.replace(tmp_path, path)
+
+    def position(self, judgment_id):
+        return self._positions.get(judgment_id)
+
+    def similar(self, position):
+        # 回傳 (位置, cosine)
+        return [(int(j), float(s)) for j, s in zip(self.neighbors[position], self.scores[position]) if j >= 0]
+
+    def shared_features(self, a, b, limit=3):
+        # 兩個判決共同特徵中對相似度貢獻最大的幾個
+        product = self.matrix[a].multiply(self.matrix[b]).tocoo()
+        best = np.argsort(-product.data, kind='stable')[:limit]
+        return [decode_key(self.vocabulary[column]) for column in product.col[best]]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def similarity_index(conn, path=SIMILARITY_PATH):
+    # 第一次使用時由磁碟讀入，之後資料庫有變動才增量更新並寫回
+    global _index
+    with _lock:
+        index = _index
+        if index is None:
+            try:
+                index = SimilarityIndex.load(path)
+            except (OSError, ValueError, KeyError):
+                index = SimilarityIndex.build(conn)
+                index.save(path)
+        stamp = index.stamp
+        index = index.refresh(conn)
+        if not np.array_equal(index.stamp, stamp):
+            index.save(path)
+        _index = index
+        return index
+
+
+def describe(conn, index, features):
+    relations = dict(conn.execute('SELECT id, name FROM relation'))
+    entity_ids = [feature[2] for feature in features if feature[0] == 'relation_tail']
+    placeholders = ', '.join('?' * len(entity_ids))
+    entities = dict(conn.execute(f'SELECT id, name FROM entity WHERE id IN ({placeholders})', entity_ids))
+    labels = []
+    for feature in features:
+        if feature[0] == 'relation_tail':
+            labels.append(f'{relations.get(feature[1], "?")}→{entities.get(feature[2], "?")}')
+        else:
+            _, head_type, relation, tail_type = feature
+            labels.append(f'{index.type_names[head_type]}-{relations.get(relation, "?")}-{index.type_names[tail_type]}')
+    return '、'.join(labels)
+
+
+@traced('index.similar')
+def similar_judgments(conn, jid, limit=TOP_K):
+    # 供 SecondWindow 顯示：(JID, 相似度, 主要共同特徵)
+    row = conn.execute('SELECT id FROM judgment WHERE jid = ?', (jid,)).fetchone()
+    index = similarity_index(conn)
+    position = index.position(row[0]) if row else None
+    if position is None:
+        return []
+    results = index.similar(position)[:limit]
+    if not results:
+        return []
+    ids = [int(index.judgment_ids[j]) for j, _ in results]
+    jids = dict(conn.execute(f"SELECT id, jid FROM judgment WHERE id IN ({', '.join('?' * len(ids))})", ids))
+    return [(jids[id], round(score, 3), describe(conn, index, index.shared_features(position, j)))
+            for (j, score), id in zip(results, ids)]
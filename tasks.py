@@ -0,0 +1,132 @@
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from tracing import span
+
+_local = threading.local()
+
+
+class CancelledError(Exception):
+    pass
+
+
+def current_task():
+    # 在背景工作中取得目前執行的 Task，用來回報進度或檢查是否已被取消
+    return getattr(_local, 'task', None)
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, object)
+    progress = pyqtSignal(object, int)
+
+
+class Task(QRunnable):
+    def __init__(self, key, fn, args, on_result, on_error):
+        super(Task, self).__init__()
+        self.setAutoDelete(False)
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.on_result = on_result
+        self.on_error = on_error
+        self.signals = TaskSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def isCancelled(self):
+        return self._cancelled.is_set()
+
+    def raiseIfCancelled(self):
+        if self._cancelled.is_set():
+            raise CancelledError(self.key)
+
+    def setProgress(self, percent):
+        self.raiseIfCancelled()
+        self.signals.progress.emit(self, int(percent))
+
+    def run(self):
+        if self._cancelled.is_set():
+            self.signals.failed.emit(self, CancelledError(self.key))
+            return
+        _local.task = self
+        try:
+            with span('task.' + str(self.key)):
+                result = self.fn(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(self, e)
+        else:
+            self.signals.finished.emit(self, result)
+        finally:
+            _local.task = None
+
+
+class TaskScheduler(QObject):
+    # 同一個 key 只保留最新的一個工作：新工作送出時，舊的工作若還在排隊就移除，
+    # 已在執行的則標記為取消，結果不會再送回 GUI
+    busyChanged = pyqtSignal(bool)
+    progress = pyqtSignal(str, int)
+
+    def __init__(self, parent=None, max_threads=4):
+        super(TaskScheduler, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.pool.setExpiryTimeout(-1) # 保留執行緒，讓每個執行緒的 SQLite 連線可重複使用
+        self.latest = {}
+        self.running = set()
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None):
+        previous = self.latest.get(key)
+        if previous is not None:
+            previous.cancel()
+            if self.pool.tryTake(previous):
+                self.running.discard(previous)
+        task = Task(key, fn, args, on_result, on_error)
+        task.signals.finished.connect(self.onFinished)
+        task.signals.failed.connect(self.onFailed)
+        task.signals.progress.connect(self.onProgress)
+        self.latest[key] = task
+        self.running.add(task)
+        self.busyChanged.emit(True)
+        self.pool.start(task)
+        return task
+
+    def cancel(self, key):
+        task = self.latest.pop(key, None)
+        if task is not None:
+            task.cancel()
+            if self.pool.tryTake(task):
+                self.done(task)
+
+    def isCurrent(self, task):
+        return self.latest.get(task.key) is task and not task.isCancelled()
+
+    def done(self, task):
+        self.running.discard(task)
+        if self.latest.get(task.key) is task:
+            del self.latest[task.key]
+        if not self.running:
+            self.busyChanged.emit(False)
+
+    def onFinished(self, task, result):
+        current = self.isCurrent(task)
+        self.done(task)
+        if current and task.on_result is not None:
+            with span('result.' + str(task.key)):
+                task.on_result(result)
+
+    def onFailed(self, task, error):
+        current = self.isCurrent(task)
+        self.done(task)
+        if current and not isinstance(error, CancelledError) and task.on_error is not None:
+            task.on_error(error)
+
+    def onProgress(self, task, percent):
+        if self.isCurrent(task):
+            self.progress.emit(str(task.key), percent)
+
+    def waitForDone(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
@@ -0,0 +1,80 @@
+from PyQt6 import QtCore, QtWidgets
+
+import tracing
+
+REFRESH_INTERVAL = 1000
+BAR = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(histogram):
+    peak = max(histogram) or 1
+    return ''.join(BAR[min(len(BAR) - 1, count * len(BAR) // (peak + 1))] if count else ' ' for count in histogram)
+
+
+class TracePanel(QtWidgets.QWidget):
+    # 各 span 最近的延遲分布；開啟時每秒更新，可在執行中開關追蹤並匯出 Chrome trace
+    COLUMNS = ['Span', 'Count', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Histogram']
+
+    def __init__(self, parent=None):
+        super(TracePanel, self).__init__(parent, QtCore.Qt.WindowType.Window)
+        self.setWindowTitle('Tracing')
+        self.resize(720, 420)
+        self.enable_box = QtWidgets.QCheckBox('Enable tracing')
+        self.enable_box.setChecked(tracing.enabled)
+        self.enable_box.toggled.connect(tracing.set_enabled)
+        reset_btn = QtWidgets.QPushButton('Reset')
+        reset_btn.clicked.connect(self.reset)
+        export_btn = QtWidgets.QPushButton('Export Trace…')
+        export_btn.clicked.connect(self.exportTrace)
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeaderItem(5).setToolTip(
+            'Buckets (ms): <' + ', <'.join(map(str, tracing.BUCKETS_MS)) + f', ≥{tracing.BUCKETS_MS[-1]}')
+
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.enable_box)
+        buttons.addStretch(1)
+        buttons.addWidget(reset_btn)
+        buttons.addWidget(export_btn)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.enable_box.setChecked(tracing.enabled)
+        self.refresh()
+        self.timer.start()
+        super(TracePanel, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(TracePanel, self).hideEvent(event)
+
+    def refresh(self):
+        rows = tracing.summary()
+        self.table.setRowCount(len(rows))
+        for row, (name, count, p50, p95, peak, histogram) in enumerate(rows):
+            values = [name, str(count), f'{p50:.1f}', f'{p95:.1f}', f'{peak:.1f}', sparkline(histogram)]
+            for column, value in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+                elif item.text() != value:
+                    item.setText(value)
+        self.table.resizeColumnsToContents()
+
+    def reset(self):
+        tracing.reset()
+        self.refresh()
+
+    def exportTrace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export Trace', 'trace.json', 'Chrome trace (*.json)')
+        if path:
+            count = tracing.export_chrome_trace(path)
+            QtWidgets.QMessageBox.information(self, 'Tracing', f'{count} events written to {path}')
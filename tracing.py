@@ -0,0 +1,134 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 關閉時 span() 只回傳同一個空的 context manager，traced 只多一次旗標判斷
+HISTORY = 1000
+MAX_EVENTS = 200000
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+_lock = threading.Lock()
+_origin = time.perf_counter_ns()
+_events = deque(maxlen=MAX_EVENTS)
+_history = {}
+_threads = {}
+enabled = os.environ.get('CAMLKG_TRACE', '') not in ('', '0')
+
+
+def set_enabled(on):
+    global enabled
+    enabled = bool(on)
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _history.clear()
+
+
+def record(name, category, start_ns, end_ns, args=None):
+    thread = threading.current_thread()
+    event = {'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+             'ts': (start_ns - _origin) / 1000, 'dur': (end_ns - start_ns) / 1000}
+    if args:
+        event['args'] = {key: str(value) for key, value in args.items()}
+    with _lock:
+        _events.append(event)
+        _history.setdefault(name, deque(maxlen=HISTORY)).append((end_ns - start_ns) / 1e6)
+        _threads[thread.ident] = thread.name
+
+
+class Span:
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.category = name.split('.', 1)[0]
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        record(self.name, self.category, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+def span(name, **args):
+    # 名稱的第一段作為分類，例如 sql.page、geometry.load、widget.map_view
+    if not enabled:
+        return _NULL
+    return Span(name, args)
+
+
+def traced(name):
+    # 包裝 slot：PyQt 會把 signal 的參數 (例如 clicked 的 checked) 傳進來，依原函式可接受的數量截掉多的
+    def decorate(fn):
+        parameters = inspect.signature(fn).parameters.values()
+        if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+            limit = None
+        else:
+            limit = sum(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in parameters)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            args = args[:limit]
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Span(name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summary():
+    # 每個 span 最近 HISTORY 次的 (名稱, 次數, p50, p95, 最大值, 各區間次數)，單位 ms
+    with _lock:
+        history = {name: list(values) for name, values in _history.items()}
+    rows = []
+    for name, values in sorted(history.items()):
+        histogram = [0] * (len(BUCKETS_MS) + 1)
+        for value in values:
+            histogram[next((i for i, edge in enumerate(BUCKETS_MS) if value < edge), len(BUCKETS_MS))] += 1
+        rows.append((name, len(values), percentile(values, 50), percentile(values, 95), max(values), histogram))
+    return rows
+
+
+def export_chrome_trace(path):
+    # chrome://tracing 或 Perfetto 可直接開啟
+    with _lock:
+        events = list(_events)
+        threads = dict(_threads)
+    pid = os.getpid()
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in threads.items()]
+    tmp_path = f'{path}.{pid}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                   'otherData': {'summary': [dict(zip(('name', 'count', 'p50_ms', 'p95_ms', 'max_ms', 'histogram'),
+                                                      row)) for row in summary()],
+                                 'buckets_ms': BUCKETS_MS}}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return len(events)
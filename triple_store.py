@@ -0,0 +1,212 @@
+import os
+import threading
+
+import numpy as np
+
+from entity_graph import database_stamp
+from tracing import traced
+
+STORE_PATH = './cache/triple_store.npz'
+STORE_VERSION = 1
+FETCH_ROWS = 100000
+TRIPLE_COLUMNS = ('head_type', 'head', 'relation', 'tail', 'tail_type')
+JUDGMENT_COLUMNS = ('jid', 'region', 'year', 'category', 'number')
+# 與 caml_rows view 相同的欄位順序 (不含 _key)
+CAML_COLUMNS = ('head entity type', 'head entity', 'relation', 'tail entity', 'tail entity type',
+                'JID', 'region', 'year', 'category', 'number')
+
+
+class StringInterner:
+    # 建立 TripleStore 時使用：每個不同的字串只給一個編號
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+
+    def intern(self, value):
+        value = '' if value is None else value
+        id = self._ids.get(value)
+        if id is None:
+            id = self._ids[value] = len(self.strings)
+            self.strings.append(value)
+        return id
+
+    def table(self):
+        data = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in data], out=offsets[1:])
+        return StringTable(b''.join(data), offsets)
+
+
+class StringTable:
+    # 所有字串以 UTF-8 串接成一個 bytes 加上各字串的起點，用到時才解碼，
+    # 不必為數十萬個字串各保留一個 Python 物件
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id):
+        return self.blob[self.offsets[id]:self.offsets[id + 1]].decode('utf-8')
+
+    def lookup(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        blob = self.blob
+        return [blob[start:end].decode('utf-8')
+                for start, end in zip(self.offsets[ids].tolist(), self.offsets[ids + 1].tolist())]
+
+
+def fetch_array(conn, sql, width):
+    # 分批讀成 int64 陣列，避免一次保留上百萬個 Python tuple
+    cur = conn.execute(sql)
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, width))
+    return np.concatenate(chunks) if chunks else np.zeros((0, width), dtype=np.int64)
+
+
+def lookup_table(rows, strings):
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    names = np.array([strings.intern(row[1]) for row in rows], dtype=np.int32)
+    return ids, names
+
+
+def fetch_entities(conn, strings):
+    rows = conn.execute('SELECT id, name, type FROM entity ORDER BY id').fetchall()
+    ids, names = lookup_table(rows, strings)
+    types = np.array([strings.intern(row[2]) for row in rows], dtype=np.int32)
+    return ids, names, types
+
+
+class TripleRows:
+    # 一段連續的三元組 (通常是一個判決)，欄位都是 TripleStore 陣列的 view，取值時才轉成字串
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def keys(self):
+        return self.store.triple_ids[self.start:self.stop]
+
+    def columns(self, start=0, stop=None):
+        # 與 caml_rows 相同的 10 個欄位 (column-major)，start / stop 為這一段中的相對位置
+        stop = len(self) if stop is None else min(stop, len(self))
+        rows = slice(self.start + start, self.start + stop)
+        strings = self.store.strings
+        judgments = self.store.judgment[rows]
+        columns = [strings.lookup(self.store.columns[name][rows]) for name in TRIPLE_COLUMNS]
+        columns += [strings.lookup(self.store.judgment_columns[name][judgments]) for name in JUDGMENT_COLUMNS]
+        return columns
+
+    def triples(self):
+        # 知識圖譜使用的 (head type, head, relation, tail, tail type)
+        return list(zip(*self.columns()[:len(TRIPLE_COLUMNS)]))
+
+
+class TripleStore:
+    # 唯讀的三元組表：字串表 + int32 欄位，依 (判決, 三元組 id) 排序；
+    # offsets[p]:offsets[p + 1] 是第 p 個判決的三元組，取一個判決的資料只需切片
+    def __init__(self, strings, columns, judgment, triple_ids, judgment_ids, judgment_columns, offsets, stamp):
+        self.strings = strings
+        self.columns = columns
+        self.judgment = judgment
+        self.triple_ids = triple_ids
+        self.judgment_ids = judgment_ids
+        self.judgment_columns = judgment_columns
+        self.offsets = offsets
+        self.stamp = stamp
+        self._positions = {jid: p for p, jid in enumerate(strings.lookup(self.judgment_columns['jid']))}
+
+    @classmethod
+    @traced('store.build')
+    def build(cls, conn):
+        stamp = database_stamp(conn)
+        strings = StringInterner()
+
+        judgments = conn.execute(
+            'SELECT id, jid, region, year, category, number FROM judgment ORDER BY id').fetchall()
+        judgment_ids = np.array([row[0] for row in judgments], dtype=np.int64)
+        judgment_columns = {name: np.array([strings.intern(row[i]) for row in judgments], dtype=np.int32)
+                            for i, name in enumerate(JUDGMENT_COLUMNS, 1)}
+
+        # entity / relation 的 id 先轉成字串編號的查詢表
+        entities = fetch_entities(conn, strings)
+        relation_ids, relation_names = lookup_table(
+            conn.execute('SELECT id, name FROM relation ORDER BY id').fetchall(), strings)
+
+        triples = fetch_array(conn, 'SELECT id, judgment_id, head_id, relation_id, tail_id FROM triple '
+                                    'ORDER BY judgment_id, id', 5)
+        judgment = np.searchsorted(judgment_ids, triples[:, 1]).astype(np.int32)
+        entity_ids, entity_names, entity_types = entities
+        head = np.searchsorted(entity_ids, triples[:, 2])
+        tail = np.searchsorted(entity_ids, triples[:, 4])
+        columns = {'head_type': entity_types[head], 'head': entity_names[head],
+                   'relation': relation_names[np.searchsorted(relation_ids, triples[:, 3])],
+                   'tail': entity_names[tail], 'tail_type': entity_types[tail]}
+        offsets = np.zeros(len(judgment_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(judgment, minlength=len(judgment_ids)), out=offsets[1:])
+        return cls(strings.table(), columns, judgment, triples[:, 0].copy(), judgment_ids, judgment_columns,
+                   offsets, stamp)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != STORE_VERSION:
+                raise ValueError(f'{path}: triple store version {int(data["version"])}')
+            strings = StringTable(data['string_blob'].tobytes(), data['string_offsets'])
+            columns = {name: data[name] for name in TRIPLE_COLUMNS}
+            judgment_columns = {name: data['judgment_' + name] for name in JUDGMENT_COLUMNS}
+            return cls(strings, columns, data['judgment'], data['triple_ids'], data['judgment_ids'],
+                       judgment_columns, data['offsets'], data['stamp'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp_path, version=STORE_VERSION, string_blob=np.frombuffer(self.strings.blob, dtype=np.uint8),
+                 string_offsets=self.strings.offsets,
+                 judgment=self.judgment, triple_ids=self.triple_ids, judgment_ids=self.judgment_ids,
+                 offsets=self.offsets, stamp=self.stamp, **self.columns,
+                 **{'judgment_' + name: values for name, values in self.judgment_columns.items()})
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.triple_ids)
+
+    def position(self, jid):
+        return self._positions.get(jid)
+
+    def rows(self, jid):
+        # 一個判決的三元組；不存在的 JID 回傳空的一段
+        position = self.position(jid)
+        if position is None:
+            return TripleRows(self, 0, 0)
+        return TripleRows(self, int(self.offsets[position]), int(self.offsets[position + 1]))
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def triple_store(conn, path=STORE_PATH):
+    # 與 entity_index 相同：資料庫沒有變動時沿用記憶體或磁碟上的資料，否則重新建立並寫回磁碟
+    global _store
+    stamp = database_stamp(conn)
+    with _lock:
+        if _store is not None and np.array_equal(_store.stamp, stamp):
+            return _store
+        try:
+            store = TripleStore.load(path)
+        except (OSError, ValueError, KeyError):
+            store = None
+        if store is None or not np.array_equal(store.stamp, stamp):
+            store = TripleStore.build(conn)
+            store.save(path)
+        _store = store
+        return store